@@ -1,10 +1,21 @@
 from typing import Any, Dict, List, Optional
+import os
+import atexit
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from tqdm import tqdm
 from langchain_core.embeddings import Embeddings
 from langchain_core.pydantic_v1 import BaseModel
-from sentence_transformers import SentenceTransformer
+
+from src.embeddings.cache import EmbeddingCache
 
 
 def test():
+    from sentence_transformers import SentenceTransformer
+
     model = SentenceTransformer("../models/bge-base-en-v1.5")
     sentences_1 = ["Test-1", "Test-2"]
     sentences_2 = ["Test-3", "Test-4"]
@@ -14,32 +25,209 @@ def test():
     print(similarity)
 
 
+_worker_model = None  # model replica of an encode pool worker
+
+
+def load_encoder(model_path, backend="torch", onnx_int8=False, intra_op_threads=None):
+    """SentenceTransformer, or OnnxEncoder for the onnx backend"""
+    if backend == "onnx":
+        from src.embeddings.onnx_backend import load_onnx_encoder
+
+        return load_onnx_encoder(model_path, quantized=onnx_int8, intra_op_threads=intra_op_threads)
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+
+        if intra_op_threads is not None:
+            import torch
+            torch.set_num_threads(intra_op_threads)
+        return SentenceTransformer(model_path, device="cpu" if intra_op_threads is not None else None)
+    raise ValueError(f"Unknown embedding backend {backend}, use torch or onnx")
+
+
+# Read by OpenMP/MKL/OpenBLAS when they are loaded, i.e. when a spawned worker unpickles its initializer and
+# imports numpy, so they must already be in the environment the worker is spawned with
+thread_env_names = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def _init_encode_worker(model_path, backend, onnx_int8, threads):
+    """Load the worker's model replica, torch/ONNX Runtime intra-op threads limited to its share of the cores"""
+    global _worker_model
+    _worker_model = load_encoder(model_path, backend, onnx_int8, threads)
+
+
+def _encode_in_worker(texts, batch_size):
+    return np.asarray(_worker_model.encode(texts, batch_size=batch_size), dtype=np.float32)
+
+
 class BAAIEmbeddings(Embeddings):
     """`BAAI Embeddings"""
 
     def __init__(self,
                  model_path="../models/bge-base-en-v1.5",
+                 cache: Optional[EmbeddingCache] = None,
+                 backend: str = "torch",
+                 onnx_int8: bool = False,
+                 intra_op_threads: Optional[int] = None,
+                 encode_workers: int = 1,
+                 pool_min_texts: int = 2048,
                  ):
-
+        """
+        Args:
+            model_path: local folder or hub id of the model
+            cache: persistent embedding cache, texts already in it are not encoded again
+            backend: "torch" (SentenceTransformer) or "onnx" (ONNX Runtime on CPU, exported on first use,
+                     needs onnxruntime)
+            onnx_int8: onnx backend runs the dynamically int8-quantized model
+            intra_op_threads: onnx backend threads per inference, all cores by default
+            encode_workers: > 1 lets embed_corpus shard batches over that many worker processes, each with its
+                            own model replica and cpu_count // encode_workers threads. The pool starts on the
+                            first large job and stays up until close()
+            pool_min_texts: jobs with fewer strings to encode are encoded in this process
+        """
         super().__init__()
-        self._model = SentenceTransformer(model_path)
+        self.backend = backend
+        self.model_path = model_path
+        self.onnx_int8 = onnx_int8
+        self.model_id = os.path.basename(os.path.normpath(model_path))  # same id for local copy and hub name
+        self._model = load_encoder(model_path, backend, onnx_int8, intra_op_threads if backend == "onnx" else None)
+        if backend == "onnx":  # own cache namespace until compare_backends has shown parity with torch
+            self.model_id += "-onnx-int8" if onnx_int8 else "-onnx"
+        self.cache = cache
+        self.encode_workers = encode_workers
+        self.pool_min_texts = pool_min_texts
+        self._pool = None
+        if encode_workers > 1:
+            atexit.register(self.close)
+
+    def start_pool(self):
+        """Start the encode worker processes (model files are already exported by this process)"""
+        if self._pool is None:
+            threads = max(1, (os.cpu_count() or 1) // self.encode_workers)
+            saved = {name: os.environ.get(name) for name in thread_env_names}
+            os.environ.update({name: str(threads) for name in thread_env_names})  # inherited by the workers
+            try:
+                # spawn: forked children would inherit torch's thread pools and locks
+                self._pool = ProcessPoolExecutor(max_workers=self.encode_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_init_encode_worker,
+                                                 initargs=(self.model_path, self.backend, self.onnx_int8, threads))
+                # spawn pools start one worker per submit while none is idle: start them all while the env is set
+                for _ in range(self.encode_workers):
+                    self._pool.submit(os.getpid)
+            finally:
+                for name, value in saved.items():
+                    if value is None:
+                        os.environ.pop(name, None)
+                    else:
+                        os.environ[name] = value
+        return self._pool
+
+    def close(self):
+        """Stop the encode worker processes, they are started again by the next large job"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def _iter_encoded(self, batches: List[List[str]], batch_size: int):
+        """
+        Embeddings of each batch, in batch order.
+        Encoded in this process, or by the worker pool for large jobs with at most 2 batches per worker in flight
+        """
+        if self.encode_workers <= 1 or sum(len(batch) for batch in batches) < self.pool_min_texts:
+            for batch in batches:
+                yield self._encode(batch, batch_size)
+            return
+
+        pool = self.start_pool()
+        pending = deque()
+        remaining = iter(batches)
+        try:
+            for batch in itertools.islice(remaining, 2 * self.encode_workers):
+                pending.append(pool.submit(_encode_in_worker, batch, batch_size))
+            while pending:
+                embeddings = pending.popleft().result()
+                for batch in itertools.islice(remaining, 1):
+                    pending.append(pool.submit(_encode_in_worker, batch, batch_size))
+                yield embeddings
+        finally:  # error or consumer stopped early, drop the queued batches
+            for future in pending:
+                future.cancel()
 
     def embed_query(self, text: str) -> List[float]:
         resp = self.embed_documents([text])
         return resp[0]
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+    def embed_documents(self, texts: List[str], batch_size: int = 32) -> List[List[float]]:
         """
         Embeds a list of text documents.
 
         Args:
             texts (List[str]): A list of text documents to embed.
+            batch_size (int): Encoder batch size.
 
         Returns:
             List[List[float]]: A list of embeddings for each document in the input list.
                             Each embedding is represented as a list of float values.
         """
-        return self._model.encode(texts)
+        if self.cache is None:
+            return self._model.encode(texts, batch_size=batch_size)
+
+        embeddings = self.cache.get_many(self.model_id, texts)
+        misses = [text for text in dict.fromkeys(texts) if text not in embeddings]
+        if misses:
+            encoded = self._encode(misses, batch_size)
+            self.cache.put_many(self.model_id, misses, encoded)
+            embeddings.update(zip(misses, encoded))
+        return np.array([embeddings[text] for text in texts], dtype=np.float32)
+
+    def _encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return np.asarray(self._model.encode(texts, batch_size=batch_size), dtype=np.float32)
+
+    def token_lengths(self, texts: List[str]) -> List[int]:
+        """Number of tokens of each text, character count if the model has no tokenizer"""
+        if hasattr(self._model, "token_lengths"):  # OnnxEncoder
+            return self._model.token_lengths(texts)
+        tokenizer = getattr(self._model, "tokenizer", None)
+        if tokenizer is None:
+            return [len(text) for text in texts]
+        return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+    def embed_corpus(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """
+        Embeds every string of a knowledge base in large batches.
+        Exact duplicates are encoded once and cached strings are not encoded at all, the rest
+        are sorted by token length so each batch holds strings of similar length, then results
+        are scattered back to input order.
+
+        Args:
+            texts (List[str]): All strings to embed, may repeat.
+            batch_size (int): Strings per encoder batch.
+
+        Returns:
+            np.ndarray: (len(texts), dim) float32 matrix, row i is the embedding of texts[i].
+        """
+        unique = list(dict.fromkeys(texts))
+        if not unique:
+            return np.empty((0, 0), dtype=np.float32)
+
+        cached = self.cache.get_many(self.model_id, unique) if self.cache is not None else {}
+        misses = [i for i, text in enumerate(unique) if text not in cached]
+        lengths = self.token_lengths([unique[i] for i in misses])
+        by_length = [misses[j] for j in sorted(range(len(misses)), key=lambda j: lengths[j])]
+
+        unique_embeddings = [cached.get(text) for text in unique]
+        buckets = [by_length[start:start + batch_size] for start in range(0, len(by_length), batch_size)]
+        bucket_texts = [[unique[i] for i in bucket] for bucket in buckets]
+        encoded = self._iter_encoded(bucket_texts, batch_size)
+        for bucket, batch, embeddings in tqdm(zip(buckets, bucket_texts, encoded), total=len(buckets)):
+            if self.cache is not None:
+                self.cache.put_many(self.model_id, batch, embeddings)
+            for i, embedding in zip(bucket, embeddings):
+                unique_embeddings[i] = embedding
+
+        unique_embeddings = np.array(unique_embeddings, dtype=np.float32)
+        row = {text: i for i, text in enumerate(unique)}
+        return unique_embeddings[[row[text] for text in texts]]
 
 if __name__ == '__main__':
     test()
\ No newline at end of file
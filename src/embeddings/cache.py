@@ -0,0 +1,59 @@
+import hashlib
+import unicodedata
+
+import numpy as np
+
+from src.utils.kvstore import SqliteLRU
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC and collapsed whitespace, variants that embed identically share one cache entry"""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache, keyed by (model id, normalized text hash).
+    One store is meant to be shared by all knowledge bases, so repeated boilerplate is encoded once.
+    """
+
+    def __init__(self, path, max_bytes=1 << 30):
+        """
+        Args:
+            path: sqlite file of the cache
+            max_bytes: size cap, least recently used embeddings are evicted first
+        """
+        self.store = SqliteLRU(path, max_bytes=max_bytes)
+
+    @staticmethod
+    def key(model_id, text):
+        return model_id + ':' + hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+    def get_many(self, model_id, texts):
+        """
+        Args:
+            model_id: embedding model id
+            texts: texts to look up
+
+        Returns:
+            {text: float32 embedding} for cached texts
+        """
+        keys = {self.key(model_id, text): text for text in texts}
+        found = self.store.get_many(list(keys))
+        return {keys[key]: np.frombuffer(value, dtype=np.float32) for key, value in found.items()}
+
+    def put_many(self, model_id, texts, embeddings):
+        self.store.put_many({self.key(model_id, text): np.asarray(embedding, dtype=np.float32).tobytes()
+                             for text, embedding in zip(texts, embeddings)})
+
+    @property
+    def hits(self):
+        return self.store.hits
+
+    @property
+    def misses(self):
+        return self.store.misses
+
+    def stats(self):
+        """hits, misses, hit_rate, entries, bytes"""
+        return self.store.stats()
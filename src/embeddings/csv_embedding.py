@@ -1,80 +1,137 @@
 import csv
 import os
 
-from tqdm import tqdm
+import numpy as np
 
-from src.loaders.file import File, EmbeddedFile, read_documents_csv
-from src.loaders.object import Object, EmbeddedObject, read_objects_csv
-from src.loaders.tags import Tags, EmbeddedTag, read_tags_csv
+from src.loaders.file import File, EmbeddedFile, read_documents_file, read_legacy_embedded_documents
+from src.loaders.object import Object, EmbeddedObject, embedded_object_fields, object_id_bits, object_file_id, \
+    read_objects_file, read_legacy_embedded_objects
+from src.loaders.tags import Tags, EmbeddedTag, read_tags_file, read_legacy_embedded_tags
 from src.embeddings.baai import BAAIEmbeddings
+from src.storages.vector_store import VectorStore, to_matrix
+from src.storages.faiss_search import index_folder, update_index_folder
+
+documents_header = ["file_id"]
+objects_header = ["object_id", "file_id", "position", "date", "content", "tags"]
+tags_header = ["tag_id", "related_object_ids"]
+
+
+# Fields to materialize per embeddata table, retrieval only reads objects.search_index.
+# "vector_dtype" is the storage dtype of the vector store, float16 halves it
+default_profile = {
+    "documents": [],
+    "objects": ["search_index"],
+    "tags": [],
+    "vector_dtype": "float32",
+}
+full_profile = {
+    "documents": ["file_path"],
+    "objects": embedded_object_fields,
+    "tags": ["tag_name"],
+    "vector_dtype": "float32",
+}
+
+
+def profile_dtype(profile):
+    """Vector store dtype of an embedding profile"""
+    dtype = np.dtype(profile.get("vector_dtype", "float32"))
+    if dtype not in (np.float32, np.float16):
+        raise ValueError(f"vector_dtype must be float32 or float16, got {dtype}")
+    return dtype
+
+
+def object_field_text(object: Object, field: str) -> str:
+    """
+    Text embedded for one field of an Object
+    Args:
+        object: Object
+        field: one of embedded_object_fields
+
+    Returns:
+        tags(date+table name+tags) as search_index for tables，content for text
+    """
+    if field == "search_index":
+        if type(object.content) is dict:
+            # sorted, set order differs between processes and after a csv round trip
+            return ','.join(sorted(object.date)) + "[SEP]" + object.title + "[SEP]" + ','.join(sorted(object.tags))
+        return object.content
+    return getattr(object, field)
 
 
-def documents_embedding(model: BAAIEmbeddings, documents: list[File]):
+def documents_embedding(model: BAAIEmbeddings, documents: list[File], fields=None, batch_size=64):
     """
     Save Embeddings of File to EmbeddedFile
     Args:
         model: embedding model
         documents: File list
+        fields: fields to embed, default_profile["documents"] by default
+        batch_size: encoder batch size
 
     Returns:
         EmbeddedFile list
     """
-    embed_documents = []
-    for doc in tqdm(documents):
-        embed_doc = EmbeddedFile(file_id=doc.file_id, file_path=model.embed_query(doc.file_path))
-        embed_documents.append(embed_doc)
+    if fields is None:
+        fields = default_profile["documents"]
 
-    return embed_documents
+    file_paths = [None] * len(documents)
+    if "file_path" in fields:
+        file_paths = model.embed_corpus([doc.file_path for doc in documents], batch_size)
 
+    return [EmbeddedFile(file_id=doc.file_id, file_path=file_path) for doc, file_path in zip(documents, file_paths)]
 
-def objects_embedding(model: BAAIEmbeddings, objects: list[Object]):
+
+def objects_embedding(model: BAAIEmbeddings, objects: list[Object], fields=None, batch_size=64):
     """
-    Save Embeddings of Object to EmbeddedObject，tags(date+table name+tags) for tables，content for text
+    Save Embeddings of Object to EmbeddedObject，tags(date+table name+tags) for tables，content for text.
+    All strings of all objects are embedded together by model.embed_corpus
     Args:
         model: embedding model
         objects: Object list
+        fields: fields to embed, default_profile["objects"] by default, skipped fields stay None
+        batch_size: encoder batch size
 
     Returns:
         EmbeddedObject list
     """
+    if fields is None:
+        fields = default_profile["objects"]
+
+    texts = [object_field_text(object, field) for object in objects for field in fields]
+    embeddings = model.embed_corpus(texts, batch_size)
+
     embed_objects = []
-    for object in tqdm(objects):
-        if type(object.content) is dict:
-            embed_list = model.embed_documents([object.file_name, object.above, object.below, object.title,
-                                                ','.join(object.date) + "[SEP]" + object.title + "[SEP]" + ','.join(
-                                                    object.tags)])
-            embed_object = EmbeddedObject(object_id=object.object_id, file_id=object.file_id,
-                                          file_name=embed_list[0],
-                                          position=object.position, above=embed_list[1], below=embed_list[2],
-                                          title=embed_list[3], date=object.date, content=object.content,
-                                          tags=object.tags, search_index=embed_list[4])
-        else:
-            embed_list = model.embed_documents([object.file_name, object.above, object.below, object.title, object.content])
-            embed_object = EmbeddedObject(object_id=object.object_id, file_id=object.file_id,
-                                          file_name=embed_list[0],
-                                          position=object.position, above=embed_list[1], below=embed_list[2],
-                                          title=embed_list[3], date=object.date, content=embed_list[4],
-                                          tags=object.tags, search_index=embed_list[4])
+    for i, object in enumerate(objects):
+        embedding = {field: embeddings[i * len(fields) + j] for j, field in enumerate(fields)}
+        content = object.content if type(object.content) is dict else embedding.get("search_index")
+        embed_object = EmbeddedObject(object_id=object.object_id, file_id=object.file_id,
+                                      position=object.position, date=object.date, content=content,
+                                      tags=object.tags, **embedding)
 
         embed_objects.append(embed_object)
     return embed_objects
 
 
-def tags_embedding(model: BAAIEmbeddings, tags: Tags):
+def tags_embedding(model: BAAIEmbeddings, tags: Tags, fields=None, batch_size=64):
     """
     Save Embeddings of Tags to EmbeddedTags
     Args:
         model: embedding model
         tags: Tags
+        fields: fields to embed, default_profile["tags"] by default
+        batch_size: encoder batch size
 
     Returns:
         EmbeddedTags
     """
-    embed_tags = []
-    for tag in tqdm(tags.tags_dict):
-        embed_tag = model.embed_query(tag)
-        embed_tags.append(EmbeddedTag(tag_name=embed_tag, related_object_ids=tags.tags_dict[tag]))
-    return embed_tags
+    if fields is None:
+        fields = default_profile["tags"]
+
+    tag_names = [None] * len(tags.tags_dict)
+    if "tag_name" in fields:
+        tag_names = model.embed_corpus(list(tags.tags_dict), batch_size)
+
+    return [EmbeddedTag(tag_name=tag_name, related_object_ids=tags.tags_dict[tag])
+            for tag, tag_name in zip(tags.tags_dict, tag_names)]
 
 
 def init_embed_folder(path: str):
@@ -97,65 +154,189 @@ def init_embed_folder(path: str):
     return output_path
 
 
-def embed_documents_to_csv(model, input_path):
-    docs = read_documents_csv(input_path)
-    output_path = init_embed_folder(input_path)
-    # File Embedding
-    embedded_docs = documents_embedding(model, docs)
-
-    csv_path = os.path.join(output_path, "documents.csv")
+def write_embedded(output_path, name, header, elements, ids, fields=None, dtype=np.float32):
+    """
+    Write embedded elements to embeddata，metadata to '<name>.csv' and vectors to the binary VectorStore
+    Args:
+        output_path: embeddata folder
+        name: documents/objects/tags
+        header: csv header
+        elements: EmbeddedFile/EmbeddedObject/EmbeddedTag list
+        ids: id of each element, row key of the vector store
+        fields: {field: matrix} to store instead of the elements' own vectors
+        dtype: vector storage dtype
+    """
+    csv_path = os.path.join(output_path, name + ".csv")
     with open(csv_path, mode='w', newline='', encoding='utf-8') as file:
         writer = csv.writer(file)
-        writer.writerow(["file_id, file_path"])
+        writer.writerow(header)
 
-        for doc in embedded_docs:
-            writer.writerow(doc.to_list())
+        for element in elements:
+            writer.writerow(element.to_list())
     file.close()
-    return embedded_docs
 
+    if fields is None:
+        fields = {}
+        for element in elements:
+            for field, vector in element.vectors().items():
+                if vector is not None:  # not in the embedding profile
+                    fields.setdefault(field, []).append(vector)
+    VectorStore(output_path, name).write(ids, fields, dtype)
 
-def embed_objects_to_csv(model, input_path):
-    objects = read_objects_csv(input_path)
+
+def embed_documents_to_csv(model, input_path, profile=None, batch_size=64):
+    profile = default_profile if profile is None else profile
+    docs = read_documents_file(input_path)
     output_path = init_embed_folder(input_path)
-    # Objects Embedding
-    embedded_objects = objects_embedding(model, objects)
+    # File Embedding
+    embedded_docs = documents_embedding(model, docs, profile["documents"], batch_size)
 
-    csv_path = os.path.join(output_path, "objects.csv")
-    with open(csv_path, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.writer(file)
-        writer.writerow(["object_id", "file_id", "file_name", "position", "above", "below", "title",
-                         "date", "content", "tags", "search_index"])
+    write_embedded(output_path, "documents", documents_header, embedded_docs,
+                   [doc.file_id for doc in embedded_docs], dtype=profile_dtype(profile))
+    return embedded_docs
 
-        for obj in embedded_objects:
-            writer.writerow(obj.to_list())
-    file.close()
+
+def embed_objects_to_csv(model, input_path, profile=None, batch_size=64, update_file_ids=None, drop_file_ids=()):
+    """
+    Embed the extracted objects to embeddata
+    Args:
+        model: embedding model
+        input_path: outputdata folder
+        profile: embedding profile
+        batch_size: encoder batch size
+        update_file_ids: if given and the stored fields match the profile, only objects of these files are
+                         embedded and the stored rows of all other files are kept
+        drop_file_ids: files whose stored rows are removed (deleted files)
+
+    Returns:
+        Newly embedded EmbeddedObject list
+    """
+    profile = default_profile if profile is None else profile
+    fields = profile["objects"]
+    objects = read_objects_file(input_path)
+    output_path = init_embed_folder(input_path)
+    store = VectorStore(output_path, "objects")
+
+    if update_file_ids is None or not store.exists() or store.fields() != sorted(fields):
+        # Objects Embedding
+        embedded_objects = objects_embedding(model, objects, fields, batch_size)
+        write_embedded(output_path, "objects", objects_header, embedded_objects,
+                       [obj.object_id for obj in embedded_objects], dtype=profile_dtype(profile))
+        return embedded_objects
+
+    update_file_ids = set(update_file_ids)
+    dropped = list(update_file_ids | set(drop_file_ids))
+    new_objects = [obj for obj in objects if object_file_id(obj.object_id) in update_file_ids]
+    embedded_objects = objects_embedding(model, new_objects, fields, batch_size)
+
+    # Keep rows of unchanged files, read into memory so the files can be rewritten
+    stored_ids = store.ids(mmap_mode=None)
+    keep = ~np.isin(stored_ids >> object_id_bits, dropped)
+    merged = {}
+    for field in fields:
+        kept = store.load(field, mmap_mode=None)[keep]
+        new = to_matrix([getattr(obj, field) for obj in embedded_objects])
+        merged[field] = np.concatenate([kept, new]) if len(new) else kept
+
+    by_id = {obj.object_id: obj for obj in objects}
+    kept_objects = [by_id[object_id] for object_id in stored_ids[keep].tolist()]
+    elements = [EmbeddedObject(object_id=obj.object_id, file_id=obj.file_id, position=obj.position, date=obj.date,
+                               content=obj.content if type(obj.content) is dict else None, tags=obj.tags)
+                for obj in kept_objects] + embedded_objects
+    write_embedded(output_path, "objects", objects_header, elements,
+                   [obj.object_id for obj in elements], merged, profile_dtype(profile))
     return embedded_objects
 
 
-def embed_tags_to_csv(model, input_path):
-    tags = read_tags_csv(input_path)
+def embed_tags_to_csv(model, input_path, profile=None, batch_size=64):
+    profile = default_profile if profile is None else profile
+    tags = read_tags_file(input_path)
     output_path = init_embed_folder(input_path)
     # Tags Embedding
-    embedded_tags = tags_embedding(model, tags)
-
-    csv_path = os.path.join(output_path, "tags.csv")
-    with open(csv_path, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.writer(file)
-        writer.writerow(["tag_id, tag_name, related_object_ids"])
+    embedded_tags = tags_embedding(model, tags, profile["tags"], batch_size)
 
-        for obj in embedded_tags:
-            writer.writerow(obj.to_list())
-    file.close()
+    write_embedded(output_path, "tags", tags_header, embedded_tags,
+                   [tag.tag_id for tag in embedded_tags], dtype=profile_dtype(profile))
     return embedded_tags
 
 
-def embed_folder(model, input_path):
-    print("Embedding documents.csv")
-    embed_documents_to_csv(model, input_path)
-    print("Embedding objects.csv")
-    embed_objects_to_csv(model, input_path)
-    print("Embedding tags.csv")
-    embed_tags_to_csv(model, input_path)
+def embed_missing_object_fields(model, input_path, fields):
+    """
+    Compute object fields that were skipped by the embedding profile, on demand, and add them to the vector store
+    Args:
+        model: embedding model
+        input_path: outputdata folder of the knowledge base
+        fields: object fields that are needed
+
+    Returns:
+        Fields that were computed
+    """
+    store = VectorStore(init_embed_folder(input_path), "objects")
+    missing = [field for field in fields if field not in store.fields()]
+    if not missing:
+        return []
+
+    objects = {obj.object_id: obj for obj in read_objects_file(input_path)}
+    ordered = [objects[object_id] for object_id in store.ids().tolist()]
+    for field in missing:
+        print(f"Embedding objects.{field}")
+        store.add_field(field, model.embed_corpus([object_field_text(obj, field) for obj in ordered]))
+    return missing
+
+
+def is_legacy_embed_folder(embed_path):
+    """Embeddata folder written before the binary vector store: objects.csv without objects.ids.npy"""
+    return os.path.exists(os.path.join(embed_path, "objects.csv")) and not VectorStore(embed_path, "objects").exists()
+
+
+def convert_legacy_folder(embed_path):
+    """
+    Convert an embeddata folder with stringified embeddings in CSV to the binary vector store, in place
+    Args:
+        embed_path: embeddata folder of a knowledge base
+    """
+    legacy = [("documents", documents_header, read_legacy_embedded_documents, lambda e: e.file_id),
+              ("objects", objects_header, read_legacy_embedded_objects, lambda e: e.object_id),
+              ("tags", tags_header, read_legacy_embedded_tags, lambda e: e.tag_id)]
+
+    for name, header, reader, get_id in legacy:
+        if VectorStore(embed_path, name).exists():
+            print(f"{name}.csv already converted, skipping")
+            continue
+        if not os.path.exists(os.path.join(embed_path, name + ".csv")):
+            continue
+
+        print(f"Converting {name}.csv")
+        elements = reader(embed_path)
+        write_embedded(embed_path, name, header, elements, [get_id(e) for e in elements])
+
+
+def embed_folder(model, input_path, index_spec="flat", profile=None, batch_size=64,
+                 update_file_ids=None, drop_file_ids=()):
+    """
+    Embed a knowledge base and build its index
+    Args:
+        model: embedding model
+        input_path: outputdata folder of the knowledge base
+        index_spec: FaissIdx index_spec
+        profile: fields to materialize per table, default_profile (only objects.search_index) by default
+        batch_size: encoder batch size
+        update_file_ids: ids of added/changed files for an incremental update, None embeds everything
+        drop_file_ids: ids of deleted files for an incremental update
+    """
+    print("Embedding documents")
+    embed_documents_to_csv(model, input_path, profile, batch_size)
+    print("Embedding objects")
+    embed_objects_to_csv(model, input_path, profile, batch_size, update_file_ids, drop_file_ids)
+    print("Embedding tags")
+    embed_tags_to_csv(model, input_path, profile, batch_size)
+    if update_file_ids is None:
+        print("Building FAISS index")
+        index_folder(model, input_path, init_embed_folder(input_path), index_spec)
+    else:
+        print("Updating FAISS index")
+        update_index_folder(model, input_path, init_embed_folder(input_path), update_file_ids, drop_file_ids,
+                            index_spec)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,228 @@
+import os
+import json
+import time
+from typing import List
+
+import numpy as np
+import onnxruntime as ort
+from tokenizers import Tokenizer
+
+onnx_file_name = "model.onnx"
+onnx_int8_file_name = "model_int8.onnx"
+onnx_config_file_name = "onnx_config.json"
+
+
+def default_onnx_path(model_path):
+    """Folder of the exported model, next to the model folder: bge-base-en-v1.5 -> bge-base-en-v1.5-onnx"""
+    return os.path.normpath(model_path) + "-onnx"
+
+
+def read_pooling(model_path):
+    """Pooling of a sentence-transformers model folder, "cls" or "mean" (bge models use the CLS token)"""
+    config_path = os.path.join(model_path, "1_Pooling", "config.json")
+    if not os.path.exists(config_path):
+        return "cls"
+    with open(config_path, 'r', encoding='utf-8') as file:
+        config = json.load(file)
+    file.close()
+    return "mean" if config.get("pooling_mode_mean_tokens") else "cls"
+
+
+def read_max_length(model_path, default=512):
+    config_path = os.path.join(model_path, "sentence_bert_config.json")
+    if not os.path.exists(config_path):
+        return default
+    with open(config_path, 'r', encoding='utf-8') as file:
+        config = json.load(file)
+    file.close()
+    return config.get("max_seq_length", default)
+
+
+def export_onnx(model_path, onnx_path=None, quantize=False, opset_version=14):
+    """
+    Export the transformer of a sentence-transformers model to ONNX, with its tokenizer and pooling settings
+    Args:
+        model_path: local folder or hub id of the model
+        onnx_path: output folder, default_onnx_path(model_path) by default
+        quantize: also write a dynamically int8-quantized copy (weights int8, activations quantized at runtime)
+        opset_version: ONNX opset
+
+    Returns:
+        output folder
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    onnx_path = default_onnx_path(model_path) if onnx_path is None else onnx_path
+    os.makedirs(onnx_path, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModel.from_pretrained(model_path, torchscript=True).eval()  # tuple outputs for tracing
+
+    inputs = tokenizer(["Export the encoder"], return_tensors="pt")
+    # positional order of BertModel.forward
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in inputs]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(inputs[name] for name in input_names),
+                          os.path.join(onnx_path, onnx_file_name), input_names=input_names,
+                          output_names=["last_hidden_state"], dynamic_axes=dynamic_axes,
+                          opset_version=opset_version, do_constant_folding=True)
+    tokenizer.save_pretrained(onnx_path)  # tokenizer.json, read by the tokenizers library
+
+    with open(os.path.join(onnx_path, onnx_config_file_name), 'w', encoding='utf-8') as file:
+        json.dump({"pooling": read_pooling(model_path), "max_length": read_max_length(model_path),
+                   "dim": model.config.hidden_size}, file)
+    file.close()
+
+    if quantize:
+        quantize_onnx(onnx_path)
+    return onnx_path
+
+
+def quantize_onnx(onnx_path):
+    """Dynamic int8 quantization of an exported model, written next to it"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(os.path.join(onnx_path, onnx_file_name), os.path.join(onnx_path, onnx_int8_file_name),
+                     weight_type=QuantType.QInt8)
+
+
+class OnnxEncoder:
+    """
+    Sentence encoder on ONNX Runtime (CPU), same encode(texts, batch_size) interface as SentenceTransformer.
+    Outputs L2-normalized float32 vectors
+    """
+
+    def __init__(self, onnx_path, quantized=False, intra_op_threads=None):
+        """
+        Args:
+            onnx_path: folder written by export_onnx
+            quantized: run the int8 model
+            intra_op_threads: threads of one inference, all cores by default. Leave some cores free when
+                              several encoders or the UI share the node
+        """
+        with open(os.path.join(onnx_path, onnx_config_file_name), 'r', encoding='utf-8') as file:
+            config = json.load(file)
+        file.close()
+        self.pooling = config["pooling"]
+        self.max_length = config["max_length"]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(onnx_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.max_length)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads or os.cpu_count()
+        options.inter_op_num_threads = 1
+        model_file = onnx_int8_file_name if quantized else onnx_file_name
+        self.session = ort.InferenceSession(os.path.join(onnx_path, model_file), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        hidden_size = self.session.get_outputs()[0].shape[-1]  # symbolic axes are strings
+        self.dim = hidden_size if isinstance(hidden_size, int) else config.get("dim")
+
+    def encode(self, texts: List[str], batch_size: int = 32, **kwargs) -> np.ndarray:
+        """
+        Args:
+            texts: texts to encode
+            batch_size: texts per inference
+
+        Returns:
+            (len(texts), dim) float32, rows L2-normalized
+        """
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            columns = {"input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+                       "attention_mask": mask,
+                       "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)}
+            hidden = self.session.run(["last_hidden_state"], {name: columns[name] for name in self.input_names})[0]
+            if self.pooling == "mean":
+                pooled = (hidden * mask[..., None]).sum(axis=1) / np.maximum(mask.sum(axis=1, keepdims=True), 1)
+            else:
+                pooled = hidden[:, 0]
+            batches.append(pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12))
+        if not batches:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.ascontiguousarray(np.concatenate(batches), dtype=np.float32)
+
+    def token_lengths(self, texts: List[str]) -> List[int]:
+        encodings = self.tokenizer.encode_batch(texts, add_special_tokens=False)
+        return [sum(encoding.attention_mask) for encoding in encodings]  # without padding
+
+
+def load_onnx_encoder(model_path, onnx_path=None, quantized=False, intra_op_threads=None):
+    """OnnxEncoder of a model, exported (and quantized) on first use"""
+    onnx_path = default_onnx_path(model_path) if onnx_path is None else onnx_path
+    if not os.path.exists(os.path.join(onnx_path, onnx_file_name)):
+        print(f"Exporting {model_path} to ONNX")
+        export_onnx(model_path, onnx_path, quantize=quantized)
+    elif quantized and not os.path.exists(os.path.join(onnx_path, onnx_int8_file_name)):
+        print("Quantizing ONNX model to int8")
+        quantize_onnx(onnx_path)
+    return OnnxEncoder(onnx_path, quantized, intra_op_threads)
+
+
+def compare_backends(model_path, texts, queries=None, batch_size=32, intra_op_threads=None):
+    """
+    Parity and speed of the ONNX (fp32 and int8) encoders against the torch SentenceTransformer
+    Args:
+        model_path: local folder or hub id of the model
+        texts: documents, encoded in batches for throughput
+        queries: short texts encoded one at a time for latency, the first 50 texts by default
+        batch_size: encoder batch size
+        intra_op_threads: ONNX Runtime threads
+
+    Returns:
+        {backend: {"load_s", "query_ms_p50", "query_ms_p95", "docs_per_s", "min_cosine", "max_abs_diff"}},
+        min_cosine/max_abs_diff compare each backend's document vectors with torch's
+    """
+    from sentence_transformers import SentenceTransformer
+
+    queries = texts[:50] if queries is None else queries
+    loaders = {
+        "torch": lambda: SentenceTransformer(model_path, device="cpu"),
+        "onnx": lambda: load_onnx_encoder(model_path, intra_op_threads=intra_op_threads),
+        "onnx-int8": lambda: load_onnx_encoder(model_path, quantized=True, intra_op_threads=intra_op_threads),
+    }
+    load_onnx_encoder(model_path, quantized=True)  # export outside the timed loads
+
+    report, reference = {}, None
+    for backend, loader in loaders.items():
+        start = time.perf_counter()
+        encoder = loader()
+        load_s = time.perf_counter() - start
+
+        encoder.encode(queries[:1], batch_size=1)  # warm up
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            encoder.encode([query], batch_size=1)
+            latencies.append(1000 * (time.perf_counter() - start))
+
+        start = time.perf_counter()
+        vectors = np.asarray(encoder.encode(texts, batch_size=batch_size), dtype=np.float32)
+        docs_per_s = len(texts) / (time.perf_counter() - start)
+
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        if reference is None:
+            reference = vectors
+        report[backend] = {"load_s": round(load_s, 2),
+                           "query_ms_p50": round(float(np.percentile(latencies, 50)), 2),
+                           "query_ms_p95": round(float(np.percentile(latencies, 95)), 2),
+                           "docs_per_s": round(docs_per_s, 1),
+                           "min_cosine": round(float(np.min(np.sum(vectors * reference, axis=1))), 5),
+                           "max_abs_diff": float(np.max(np.abs(vectors - reference)))}
+        print(backend, report[backend])
+    return report
+
+
+if __name__ == "__main__":
+    from src.loaders.object import read_objects_file
+
+    objects = read_objects_file("D:\\CS\\CS510\\final-project\\data\\outputdata\\Store")
+    corpus = [obj.content if type(obj.content) is str else obj.to_str() for obj in objects]
+    compare_backends("../models/bge-base-en-v1.5", corpus)
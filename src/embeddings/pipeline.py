@@ -0,0 +1,142 @@
+import csv
+import os
+
+from src.loaders.csv_converter import init_output_folder, init_csv_files, list_input_files, iter_extract_files, \
+    write_to_csv, objects_csv_name, documents_csv_name, tags_csv_name
+from src.loaders.records import objects_records_name, documents_records_name, tags_records_name, write_records, \
+    dump_record, iter_records
+from src.loaders.object import object_from_record
+from src.loaders.tags import load_tags
+from src.embeddings.baai import BAAIEmbeddings
+from src.embeddings.csv_embedding import objects_embedding, objects_header, default_profile, init_embed_folder, \
+    embed_documents_to_csv, embed_tags_to_csv, profile_dtype
+from src.storages.vector_store import VectorStore, VectorStoreWriter, to_matrix
+from src.storages.faiss_search import FaissIdx, index_needs_training
+from src.storages.tag_index import TagIndex
+from src.utils.hash import build_manifest
+
+
+def iter_objects(file_objects):
+    """Flatten the per-file object lists of iter_extract_files"""
+    for objects in file_objects:
+        yield from objects
+
+
+def iter_batches(items, batch_size):
+    """Group an iterable into lists of at most batch_size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_embedded_batches(model, objects, fields, batch_size=64):
+    """
+    Embed objects batch by batch
+    Args:
+        model: embedding model
+        objects: iterable of tagged Objects
+        fields: object fields to embed
+        batch_size: objects per batch, also the encoder batch size
+
+    Yields:
+        (Object list, EmbeddedObject list) of each batch
+    """
+    for batch in iter_batches(objects, batch_size):
+        yield batch, objects_embedding(model, batch, fields, batch_size)
+
+
+def stream_folder(model, input_path, manifest=None, index_spec="flat", profile=None, batch_size=64, workers=1,
+                  add_chunk_size=65536):
+    """
+    Build a knowledge base in one pass: extract -> tag -> embed in batches -> add to index -> persist.
+    Only one batch of objects (plus the files parsed ahead by workers) is held in memory. Indexes that are
+    trained get their objects read back from objects.jsonl chunk by chunk once all vectors are written. Writes the same outputdata/embeddata files as folder_to_csv + embed_folder
+    Args:
+        model: embedding model
+        input_path: knowledge base folder under data/inputdata
+        manifest: build_manifest() of the folder, built here if not given
+        index_spec: FaissIdx index_spec, IVF/PQ indexes are trained and filled from the memory-mapped
+                    vector store once all batches are written
+        profile: embedding profile, must contain objects.search_index
+        batch_size: objects per batch
+        workers: number of processes parsing files
+        add_chunk_size: rows per index add when filling a trained index from the vector store
+
+    Returns:
+        FaissIdx of the knowledge base, also saved to embeddata
+    """
+    profile = default_profile if profile is None else profile
+    fields = profile["objects"]
+    if "search_index" not in fields:
+        raise ValueError("Streaming ingestion indexes objects.search_index, add it to the profile")
+
+    if manifest is None:
+        manifest = build_manifest(input_path)
+    file_list = list(list_input_files(input_path, manifest).values())
+    tags = load_tags()
+
+    output_path = init_output_folder(input_path)
+    embed_path = init_embed_folder(output_path)
+    document_csv_path = os.path.join(output_path, documents_csv_name)
+    object_csv_path = os.path.join(output_path, objects_csv_name)
+    tag_csv_path = os.path.join(output_path, tags_csv_name)
+    init_csv_files(document_csv_path, object_csv_path, tag_csv_path)
+    write_to_csv(file_list, document_csv_path)
+    write_records(os.path.join(output_path, documents_records_name), (file.to_record() for file in file_list))
+
+    faiss_idx = FaissIdx(model, index_spec=index_spec)
+    add_now = not index_needs_training(index_spec, faiss_idx.dim)  # else added after all vectors are written
+    writer = VectorStoreWriter(VectorStore(embed_path, "objects"), dtype=profile_dtype(profile))
+
+    with open(object_csv_path, mode='a', newline='', encoding='utf-8') as extracted_file, \
+            open(os.path.join(output_path, objects_records_name), mode='w', encoding='utf-8') as records_file, \
+            open(os.path.join(embed_path, "objects.csv"), mode='w', newline='', encoding='utf-8') as embedded_file:
+        extracted_writer = csv.writer(extracted_file)
+        embedded_writer = csv.writer(embedded_file)
+        embedded_writer.writerow(objects_header)
+
+        objects = iter_objects(iter_extract_files(file_list, tags, workers))
+        for batch, embedded_batch in iter_embedded_batches(model, objects, fields, batch_size):
+            ids = [obj.object_id for obj in batch]
+            vectors = {field: [getattr(obj, field) for obj in embedded_batch] for field in fields}
+            extracted_writer.writerows(obj.to_list() for obj in batch)
+            records_file.writelines(dump_record(obj.to_record()) for obj in batch)
+            embedded_writer.writerows(obj.to_list() for obj in embedded_batch)
+            writer.append(ids, vectors)
+
+            if add_now:
+                faiss_idx.add_vectors(to_matrix(vectors["search_index"]), batch, ids)
+    writer.close()
+    tags.to_csv(tag_csv_path)
+    write_records(os.path.join(output_path, tags_records_name), tags.to_records())
+
+    if not add_now:
+        print("Training FAISS index")
+        store = VectorStore(embed_path, "objects")
+        search_index, ids = store.load("search_index"), store.ids()
+        # objects.jsonl rows are in vector store order, one chunk of objects in memory at a time
+        records = iter_records(os.path.join(output_path, objects_records_name))
+        chunks = iter_batches((object_from_record(record) for record in records), add_chunk_size)
+        for start, chunk in zip(range(0, len(ids), add_chunk_size), chunks):
+            end = start + len(chunk)
+            if chunk[0].object_id != ids[start] or chunk[-1].object_id != ids[end - 1]:
+                raise ValueError(f"{objects_records_name} is not aligned with the vector store at row {start}")
+            faiss_idx.add_vectors(search_index[start:end], chunk, ids[start:end], train_vectors=search_index)
+
+    # documents and tags are small, embedded from their csv files
+    embed_documents_to_csv(model, output_path, profile, batch_size)
+    embed_tags_to_csv(model, output_path, profile, batch_size)
+    faiss_idx.tag_index = TagIndex.from_tags(tags)
+    faiss_idx.build_lexical_index()
+    faiss_idx.save(embed_path)
+    return faiss_idx
+
+
+if __name__ == "__main__":
+    model = BAAIEmbeddings()
+    stream_folder(model, "D:\\CS\\CS510\\final-project\\data\\inputdata\\Store")
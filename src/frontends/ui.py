@@ -1,5 +1,6 @@
 import os
-import gradio as gr
+import time
+import asyncio
 import pythoncom
 import ast
 import pandas as pd
@@ -7,12 +8,20 @@ import json
 from tabulate import tabulate
 
 from src.loaders.csv_converter import folder_to_csv
-from src.embeddings.csv_embedding import embed_folder
+from src.embeddings.csv_embedding import embed_folder, default_profile, is_legacy_embed_folder, convert_legacy_folder
+from src.embeddings.pipeline import stream_folder
 from src.embeddings.baai import BAAIEmbeddings
-from src.storages.faiss_search import FaissIdx
+from src.embeddings.cache import EmbeddingCache
+from src.storages.faiss_search import has_saved_index, index_folder
+from src.storages.registry import IndexRegistry
+from src.storages.tag_index import has_tag_index, build_tag_index
 from src.llms.chatglm import ChatGLM
 from src.llms.gemini import Gemini
-from src.utils.hash import get_folder_hash
+from src.llms.provider_registry import ProviderRegistry
+from src.llms.response_cache import ResponseCache
+from src.llms.semantic_cache import SemanticCache
+from src.utils.hash import get_folder_hash, build_manifest, diff_manifest, load_manifest, save_manifest, \
+    save_folder_hash, load_folder_hash
 from src.utils.log import get_console_logger
 
 logger = get_console_logger('Frontend')
@@ -21,17 +30,70 @@ input_data_path = "..\\..\\data\\inputdata"
 output_data_path = "..\\..\\data\\outputdata"
 embedded_data_path = "..\\..\\data\\embeddata"
 
-with open("../../config.json") as f:
-    config = json.load(f)
-    ChatGLM_api_key = config["ChatGLM_api_key"]
-    Gemini_api_key = config["Gemini_api_key"]
-
-# TODO: config part, modify before running on a new machine
-model = BAAIEmbeddings("../models/bge-base-en-v1.5") # change it into "BAAI/bge-base-en-v1.5" on new machine
-faiss_retriever = FaissIdx(model)
-chatglm_4_flash = ChatGLM(api_key=ChatGLM_api_key, model="glm-4-flash")
-chatglm_z1_flash = ChatGLM(api_key=ChatGLM_api_key, model="glm-z1-flash")
-gemini_2_flash = Gemini(api_key=Gemini_api_key, model="gemini-2.0-flash")
+# Ingestion and encode worker processes re-import this module (spawn): config, models, clients and the UI are only
+# read and created in the UI process
+if __name__ == "__main__":
+    with open("../../config.json") as f:
+        config = json.load(f)
+        ChatGLM_api_key = config["ChatGLM_api_key"]
+        Gemini_api_key = config["Gemini_api_key"]
+        index_spec = config.get("index_spec", "flat")  # index_presets key (flat/sq8/pq/pca_flat/ivf_pq/hnsw...) or a faiss factory string
+        vector_dtype = config.get("vector_dtype", "float32")  # float16 halves the vector store on disk
+        nprobe = config.get("nprobe")
+        ef_search = config.get("ef_search")
+        search_mode = config.get("search_mode", "dense")  # dense or hybrid (FAISS + BM25)
+        index_memory_mb = config.get("index_memory_mb", 2048)  # resident knowledge bases
+        embedding_cache_mb = config.get("embedding_cache_mb", 1024)
+        embedding_backend = config.get("embedding_backend", "torch")
+        if embedding_backend != "torch":
+            # ONNX vectors have not been compared with torch on a knowledge base yet (onnx_backend.compare_backends)
+            raise ValueError(f"embedding_backend {embedding_backend} is not supported in config.json, use torch")
+        embedding_workers = config.get("embedding_workers", 1)  # encoder processes for large ingestion jobs
+        ingest_workers = config.get("ingest_workers", 1)  # processes parsing documents
+        streaming_ingest = config.get("streaming_ingest", False)  # build new knowledge bases in one bounded-memory pass
+        embedding_profile = dict(default_profile, vector_dtype=vector_dtype)
+        # LLM requests, limits are per provider (ChatGLM models share one, Gemini models another)
+        llm_options = {"max_concurrency": config.get("llm_concurrency", 4),
+                       "requests_per_minute": config.get("llm_requests_per_minute"),
+                       "timeout": config.get("llm_timeout", 60),  # seconds per attempt
+                       "deadline": config.get("llm_deadline", 120),  # seconds per answer, retries included
+                       "max_retries": config.get("llm_max_retries", 3)}
+        llm_warmup = config.get("llm_warmup", "background")  # background: warm all LLMs at startup, lazy: on first use
+        llm_retry_after = config.get("llm_retry_after", 30)  # seconds before a provider that was down is tried again
+        ui_concurrency = config.get("ui_concurrency", 32)  # chat requests handled at the same time
+        stream_interval = config.get("stream_interval", 0.05)  # seconds between chatbot updates while streaming
+        llm_cache_mb = config.get("llm_cache_mb", 256)  # cached answers, 0 turns the response cache off
+        llm_cache_ttl_hours = config.get("llm_cache_ttl_hours", 168)
+        semantic_cache_enabled = config.get("semantic_cache", False)  # reuse answers of similar questions
+        semantic_threshold = config.get("semantic_threshold", 0.95)  # cosine similarity of the question embeddings
+        semantic_cache_size = config.get("semantic_cache_size", 1000)  # questions per knowledge base and model
+        semantic_skip_retrieval = config.get("semantic_skip_retrieval", False)  # hits also reuse the search results
+    # TODO: config part, modify before running on a new machine
+    # Shared by all knowledge bases, unchanged paragraphs and table keys are not encoded again
+    embedding_cache = EmbeddingCache(os.path.join(embedded_data_path, "embedding_cache.sqlite"),
+                                     max_bytes=embedding_cache_mb * 1024 * 1024)
+    model = BAAIEmbeddings("../models/bge-base-en-v1.5", cache=embedding_cache, backend=embedding_backend,
+                           encode_workers=embedding_workers) # change it into "BAAI/bge-base-en-v1.5" on new machine
+    # Answers to repeated questions over the same retrieved documents, shared by all knowledge bases
+    response_cache = ResponseCache(os.path.join(embedded_data_path, "response_cache.sqlite"),
+                                   max_bytes=llm_cache_mb * 1024 * 1024,
+                                   ttl=llm_cache_ttl_hours * 3600) if llm_cache_mb else None
+    semantic_cache = SemanticCache(semantic_threshold, semantic_cache_size,
+                                   ttl=llm_cache_ttl_hours * 3600) if semantic_cache_enabled else None
+    # One index per knowledge base, least recently used ones are unloaded above the memory budget
+    index_registry = IndexRegistry(model, memory_budget_mb=index_memory_mb, index_spec=index_spec, nprobe=nprobe,
+                                   ef_search=ef_search, search_mode=search_mode)
+    # LLM clients are created and warmed up in the background, questions get retrieval-only answers until the
+    # selected one is ready
+    llm_registry = ProviderRegistry(retry_after=llm_retry_after)
+    llm_registry.register("ChatGLM4-Flash", lambda: ChatGLM(api_key=ChatGLM_api_key, model="glm-4-flash",
+                                                            **llm_options))
+    llm_registry.register("Gemini-2.0-Flash", lambda: Gemini(api_key=Gemini_api_key, model="gemini-2.0-flash",
+                                                             **llm_options))
+    llm_registry.register("ChatGLM-Z1-Flash", lambda: ChatGLM(api_key=ChatGLM_api_key, model="glm-z1-flash",
+                                                              **llm_options))
+    if llm_warmup == "background":
+        llm_registry.warmup_all()
 
 startup_prompt = [
         {"role": "user", "content": "You are a highly skilled professional AI assistant specialized in Retrieval-Augmented Generation. Your primary goal is to help users by combining deep language understanding with relevant external knowledge retrieved from provided documents."},
@@ -57,28 +119,88 @@ def load_kg(kg_name):
     input_kg_path = os.path.abspath(os.path.join(input_data_path, kg_name))
     output_kg_path = os.path.abspath(os.path.join(output_data_path, kg_name))
     embed_kg_path = os.path.abspath(os.path.join(embedded_data_path, kg_name))
-    # Check if knowledge base is updated
-    if os.path.exists(os.path.join(embed_kg_path, "hash.txt")):  # No update, using original embeddings
-        curr_hash = get_folder_hash(input_kg_path)
-        stored_hash = open(os.path.join(embed_kg_path, "hash.txt"), "r").read()
-
-        if curr_hash == stored_hash:
-            faiss_retriever.add_folder(output_kg_path, embed_kg_path)
+    # Check which files of the knowledge base are updated
+    stored_manifest = load_manifest(embed_kg_path)
+    if stored_manifest is None and load_folder_hash(embed_kg_path) == get_folder_hash(input_kg_path):
+        # Embedded before per-file manifests and unchanged since: stringified CSV embeddings are converted to the
+        # vector store and indexed once, without re-embedding. Its ids predate the manifest file ids, so it is
+        # served by hash.txt until the folder changes and is ingested again
+        if is_legacy_embed_folder(embed_kg_path):
+            convert_legacy_folder(embed_kg_path)
+        if not has_saved_index(embed_kg_path):
+            index_folder(model, output_kg_path, embed_kg_path, index_spec)
+        elif not has_tag_index(embed_kg_path):
+            build_tag_index(output_kg_path).save(embed_kg_path)
+        index_registry.load(kg_name, embed_kg_path)
+        pythoncom.CoUninitialize()
+        return ("Successfully loaded " + kg_name + "（no update to knowledge base, using cache）\n"
+                + "Resident: " + index_registry.summary())
+    manifest = build_manifest(input_kg_path, stored_manifest)
+    added, changed, removed = diff_manifest(stored_manifest, manifest)
+
+    if stored_manifest is not None and has_saved_index(embed_kg_path):
+        if not (added or changed or removed):  # No update, using original embeddings
+            if not has_tag_index(embed_kg_path):  # indexed before tag filtering
+                build_tag_index(output_kg_path).save(embed_kg_path)
+            index_registry.load(kg_name, embed_kg_path)
+            save_manifest(embed_kg_path, manifest)  # refresh modified times
             pythoncom.CoUninitialize()
-            return "Successfully loaded " + kg_name + "（no update to knowledge base, using cache）"
-    else:  # Updated, embedding again
+            return ("Successfully loaded " + kg_name + "（no update to knowledge base, using cache）\n"
+                    + "Resident: " + index_registry.summary())
+
+        # Updated, only extract and embed added/changed files, remove deleted files
+        update_file_ids = [manifest["files"][path]["file_id"] for path in added + changed]
+        drop_file_ids = [stored_manifest["files"][path]["file_id"] for path in removed]
+        folder_to_csv(input_kg_path, manifest, added + changed, drop_file_ids, ingest_workers)
+        embed_folder(model, output_kg_path, index_spec, embedding_profile,
+                     update_file_ids=update_file_ids, drop_file_ids=drop_file_ids)
+        status = f"（knowledge base updated: {len(added)} added, {len(changed)} changed, {len(removed)} removed）"
+    elif streaming_ingest:  # New knowledge base, extract, embed and index in one pass
+        stream_folder(model, input_kg_path, manifest, index_spec, embedding_profile, workers=ingest_workers)
+        status = "（knowledge base updated）"
+    else:  # New knowledge base, embedding everything
         # Convert to CSV
-        folder_to_csv(input_kg_path)
-        # Embedding
-        embed_folder(model, output_kg_path)
-        # Load to Faiss
-        faiss_retriever.add_folder(output_kg_path, embed_kg_path)
-        # Release pywin32
-        pythoncom.CoUninitialize()
-        # Update hash
-        with open(os.path.join(embed_kg_path, "hash.txt"), 'w') as file:
-            file.write(get_folder_hash(input_kg_path))
-        return "Successfully loaded " + kg_name + "（knowledge base updated）"
+        folder_to_csv(input_kg_path, manifest, workers=ingest_workers)
+        # Embedding and index
+        embed_folder(model, output_kg_path, index_spec, embedding_profile)
+        status = "（knowledge base updated）"
+
+    model.close()  # encoder processes are only kept during ingestion
+    logger.info(f"Embedding cache: {embedding_cache.stats()}")
+    # New knowledge base version, cached answers of the old one are dropped
+    save_folder_hash(embed_kg_path, get_folder_hash(input_kg_path))
+    if response_cache is not None:
+        logger.info(f"Dropped {response_cache.invalidate(kg_name)} cached answers of {kg_name}")
+    if semantic_cache is not None:
+        logger.info(f"Dropped {semantic_cache.invalidate(kg_name)} similar-question answers of {kg_name}")
+    # Load to Faiss
+    index_registry.load(kg_name, embed_kg_path)
+    # Release pywin32
+    pythoncom.CoUninitialize()
+    # Update manifest
+    save_manifest(embed_kg_path, manifest)
+    return "Successfully loaded " + kg_name + status + "\nResident: " + index_registry.summary()
+
+
+def search_kg(kg_name, message, top_k):
+    """(object ids, top-k documents, version) of a knowledge base, nothing if it was not loaded"""
+    if kg_name not in index_registry:
+        return [], [], None
+    top_ids, top_res = index_registry.get(kg_name).search_hits(message, k=top_k)
+    return top_ids, top_res, index_registry.version(kg_name)
+
+
+def embed_question(kg_name, message):
+    """(query embedding, tags and dates of the knowledge base mentioned, version) of a question"""
+    faiss_idx = index_registry.get(kg_name)
+    terms = [] if faiss_idx.tag_index is None else sum(faiss_idx.tag_index.match(message), [])
+    # the embedding is kept in the query cache, search does not encode again
+    return faiss_idx.embed_queries([message])[0], terms, index_registry.version(kg_name)
+
+
+def llm_status_text():
+    """Readiness of each LLM provider, one per line"""
+    return "\n".join(f"{name}: {state}" for name, state in llm_registry.status().items())
 
 
 def clear_session():
@@ -86,137 +208,211 @@ def clear_session():
     return [], [], ""
 
 
-def chat_bot_response(message, top_k, history, search, llm):
+async def chat_bot_response(message, top_k, history, search, llm, kg_name):
     """Accept user input，if is 'dict', convert to table，else hand to 'predict' method to search"""
     logger.info("Using " + llm)
-    if llm == "ChatGLM4-Flash":
-        llm_model = chatglm_4_flash
-    elif llm == "Gemini-2.0-Flash":
-        llm_model = gemini_2_flash
-    elif llm == "ChatGLM-Z1-Flash":
-        llm_model = chatglm_z1_flash
+    if llm in llm_registry.names():
+        llm_model = llm_registry.get(llm)  # None until the provider is ready, its warmup is started if needed
+        llm_status = llm + " " + llm_registry.state(llm)
     else:
-        llm_model = None
+        llm_model, llm_status = None, "not loaded"
 
     if history is None:
         history = []
     if message.startswith("{") and message.endswith("}"):
         table = tabulate(pd.DataFrame(ast.literal_eval(message)), headers="keys", tablefmt="pipe", showindex=False)
         history.append((message, table))
-        return history, history, "", search
+        yield history, history, "", search
     else:
-        return predict(message, top_k, history, llm_model)
+        async for outputs in predict(message, top_k, history, llm_model, kg_name, llm_status):
+            yield outputs
 
 
-def predict(message, top_k, history, llm):
+async def predict(message, top_k, history, llm, kg_name=None, llm_status="not loaded"):
     """
-    Send message to LLM and FAISS
+    Send message to LLM and FAISS, the answer is streamed into the chatbot as it is generated
     Args:
         message: user input
         top_k: top-k hyperparameter
         history: gr.State() search history
+        kg_name: knowledge base to search, nothing is retrieved if it was not loaded
+        llm_status: shown with the search results when llm is None
 
-    Returns:
-        (chatbot, gr.State() history, ""(Reset chatbox), FAISS history)
+    Yields:
+        (chatbot, gr.State() history, ""(Reset chatbox), FAISS history), first with the search results only,
+        then with the partial answer
     """
     if history is None:
         history = []
-    top_res = faiss_retriever.search_doc(message, k=top_k)
-
+    model_name = f"{type(llm).__name__}:{llm.model}" if llm is not None else None
+    similar, question, version = None, None, None
+    if semantic_cache is not None and llm is not None and kg_name in index_registry:
+        # The registry may be reloading the knowledge base, its version is read in the thread too
+        embedding, terms, version = await asyncio.to_thread(embed_question, kg_name, message)
+        question = (kg_name, model_name, version, embedding, terms)
+        similar = semantic_cache.lookup(*question)
+
+    if similar is not None and semantic_skip_retrieval:
+        top_ids, search_res = similar[0].object_ids, similar[0].search_res
+    else:
+        # Reloading an unloaded index, embedding and search hold the CPU, run in a thread so other requests keep going
+        top_ids, top_res, version = await asyncio.to_thread(search_kg, kg_name, message, top_k)
+        search_res = ""
+        for i in range(len(top_res)):
+            search_res += f"--------No.{i+1} Search Result--------\n"
+            search_res += next(iter(top_res[i])) + "\n"
     query = "Please read the following documents：\n"
-    search_res = ""
-    for i in range(len(top_res)):
-        search_res += f"--------No.{i+1} Search Result--------\n"
-        search_res += next(iter(top_res[i])) + "\n"
     query += "Answer this according to the documents：" + message + "\n"
 
     if llm is None:
-        answer = "LLM not loaded，only returning FAISS results"
-    else:
-        logger.info("To LLM: " + query + search_res)
-        answer, _ = llm.answer(query + search_res, startup_prompt)
-    history.append((message, answer))
-    return history, history, "", search_res
-
-
-with gr.Blocks() as demo:
-    gr.Markdown("""<h1><center>Tabular RAG</center></h1>
-        <center><font size=3>
-        </center></font>
-        """)
-    state = gr.State()
-
-    with gr.Row():
-        with gr.Column(scale=1):
-            embedding_model = gr.Dropdown(
-                [
-                    "bge-base-en-v1.5",
-                ],
-                label="Embedding Model",
-                value="bge-base-en-v1.5")
-
-            large_language_model = gr.Dropdown(
-                [
-                    "ChatGLM4-Flash",
-                    "Gemini-2.0-Flash",
-                    "ChatGLM-Z1-Flash"
-                ],
-                label="Large Language Model",
-                value="Gemini-2.0-Flash")
-
-            top_k = gr.Slider(1,
-                              20,
-                              value=4,
-                              step=1,
-                              label="Top-K documents",
-                              interactive=True)
-
-            kg_name = gr.Radio(list_data_dirs(input_data_path),
-                               label="Knowledge base",
-                               value=None,
-                               info="To use knowledge base for questions, please load first",
-                               interactive=True)
-
-            set_kg_btn = gr.Button("Load knowledge base")
-
-            kg_status = gr.Textbox(label="Knowledge base status", value="Not loaded")
-
-        with gr.Column(scale=4):
-            with gr.Row():
-                chatbot = gr.Chatbot(label='Tabular RAG')
-            with gr.Row():
-                message = gr.Textbox(label='Query')
-            with gr.Row():
-                clear_history = gr.Button("🧹Clean history")
-                send = gr.Button("🚀Send")
-        with gr.Column(scale=2):
-            search = gr.Textbox(label='Search results')
-
-        # ============= Triggers =============
-        set_kg_btn.click(  # show_progress=True
-            load_kg,
-            inputs=[kg_name],  # for switching models
-            outputs=[kg_status],
-            show_progress="full")
-
-        # send
-        send.click(chat_bot_response,
-                   inputs=[message, top_k, state, search, large_language_model],
-                   outputs=[chatbot, state, message, search])
-
-        # clean history
-        clear_history.click(fn=clear_session,
-                            inputs=[],
-                            outputs=[chatbot, state, search],
-                            queue=False)
-
-        # enter key
-        message.submit(chat_bot_response,
-                       inputs=[message, top_k, state, search, large_language_model],
+        history.append((message, f"LLM {llm_status}，only returning FAISS results"))
+        yield history, history, "", search_res
+        return
+
+    if similar is not None:
+        entry, similarity = similar
+        logger.info(f"Semantic cache hit ({similarity:.3f}, \"{entry.question}\"): {semantic_cache.stats()}")
+        history.append((message, entry.answer + f"\n\n*(cached answer of a similar question: \"{entry.question}\", "
+                                                f"similarity {similarity:.2f})*"))
+        yield history, history, "", search_res
+        return
+
+    cache_key = None
+    if response_cache is not None:
+        cache_key = ResponseCache.key(kg_name or "", version, model_name,
+                                      startup_prompt[0]["content"], message, top_ids)
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached is not None:
+            logger.info(f"Response cache hit: {response_cache.stats()}")
+            history.append((message, cached + "\n\n*(cached answer)*"))
+            yield history, history, "", search_res
+            return
+
+    history.append((message, ""))
+    yield history, history, "", search_res  # search results are shown while the LLM answers
+    logger.info("To LLM: " + query + search_res)
+    answer, shown, complete = "", time.monotonic(), False
+    try:
+        async for text in llm.astream(query + search_res, startup_prompt):
+            answer += text
+            if time.monotonic() - shown >= stream_interval:  # fewer, larger chatbot updates
+                history[-1] = (message, answer)
+                yield history, history, "", search_res
+                shown = time.monotonic()
+        complete = True
+    except Exception as e:  # retries used up or deadline passed, the search results are still shown
+        logger.error(f"LLM request failed: {e}")
+        if answer:
+            answer += f"\n\n(answer interrupted: {type(e).__name__})"
+        else:
+            answer = f"LLM request failed ({type(e).__name__})，only returning FAISS results"
+    history[-1] = (message, answer.strip())
+    yield history, history, "", search_res
+    if complete and answer.strip():  # failed or interrupted answers are not kept
+        if cache_key is not None:
+            await asyncio.to_thread(response_cache.put, cache_key, answer.strip())
+        if question is not None:
+            kb_name, model_name, version, embedding, terms = question
+            semantic_cache.add(kb_name, model_name, version, embedding, message, top_ids, search_res, answer.strip(),
+                               terms)
+
+
+def build_ui():
+    """Gradio Blocks of the app, built only in the UI process"""
+    import gradio as gr
+
+    with gr.Blocks() as demo:
+        gr.Markdown("""<h1><center>Tabular RAG</center></h1>
+            <center><font size=3>
+            </center></font>
+            """)
+        state = gr.State()
+
+        with gr.Row():
+            with gr.Column(scale=1):
+                embedding_model = gr.Dropdown(
+                    [
+                        "bge-base-en-v1.5",
+                    ],
+                    label="Embedding Model",
+                    value="bge-base-en-v1.5")
+
+                large_language_model = gr.Dropdown(
+                    [
+                        "ChatGLM4-Flash",
+                        "Gemini-2.0-Flash",
+                        "ChatGLM-Z1-Flash"
+                    ],
+                    label="Large Language Model",
+                    value="Gemini-2.0-Flash")
+
+                top_k = gr.Slider(1,
+                                  20,
+                                  value=4,
+                                  step=1,
+                                  label="Top-K documents",
+                                  interactive=True)
+
+                kg_name = gr.Radio(list_data_dirs(input_data_path),
+                                   label="Knowledge base",
+                                   value=None,
+                                   info="To use knowledge base for questions, please load first",
+                                   interactive=True)
+
+                set_kg_btn = gr.Button("Load knowledge base")
+
+                kg_status = gr.Textbox(label="Knowledge base status", value="Not loaded")
+
+                llm_status = gr.Textbox(label="LLM status", value="")
+                llm_status_timer = gr.Timer(2)  # readiness changes while providers warm up in the background
+
+            with gr.Column(scale=4):
+                with gr.Row():
+                    chatbot = gr.Chatbot(label='Tabular RAG')
+                with gr.Row():
+                    message = gr.Textbox(label='Query')
+                with gr.Row():
+                    clear_history = gr.Button("🧹Clean history")
+                    send = gr.Button("🚀Send")
+            with gr.Column(scale=2):
+                search = gr.Textbox(label='Search results')
+
+            # ============= Triggers =============
+            set_kg_btn.click(  # show_progress=True
+                load_kg,
+                inputs=[kg_name],  # for switching models
+                outputs=[kg_status],
+                show_progress="full",
+                concurrency_limit=1)  # one ingestion at a time
+
+            # LLM readiness, on page load and while providers warm up
+            demo.load(llm_status_text, outputs=[llm_status], queue=False)
+            llm_status_timer.tick(llm_status_text, outputs=[llm_status], queue=False, show_progress="hidden")
+
+            # send
+            send.click(chat_bot_response,
+                       inputs=[message, top_k, state, search, large_language_model, kg_name],
                        outputs=[chatbot, state, message, search])
 
+            # clean history
+            clear_history.click(fn=clear_session,
+                                inputs=[],
+                                outputs=[chatbot, state, search],
+                                queue=False)
+
+            # enter key
+            message.submit(chat_bot_response,
+                           inputs=[message, top_k, state, search, large_language_model, kg_name],
+                           outputs=[chatbot, state, message, search])
+
+    return demo
+
 
-demo.launch(
-    show_error=True,
-    debug=True,
-)
+if __name__ == "__main__":
+    demo = build_ui()
+    # Chat handlers are async, one process keeps up to ui_concurrency requests in flight
+    demo.queue(default_concurrency_limit=ui_concurrency)
+    demo.launch(
+        show_error=True,
+        debug=True,
+    )
@@ -0,0 +1,205 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+from src.utils.log import get_console_logger
+
+logger = get_console_logger('LLMClient')
+
+# HTTP statuses worth another attempt: timeout, rate limited, server errors
+transient_statuses = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Token bucket, requests_per_minute spread evenly with bursts of up to burst requests"""
+
+    def __init__(self, requests_per_minute, burst=None):
+        self.rate = requests_per_minute / 60
+        self.capacity = burst if burst is not None else max(1, int(self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:  # no await between the check and the decrement, one event loop
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ProviderLimits:
+    """Concurrency cap and rate limit shared by every model of one provider (one API key)"""
+
+    def __init__(self, name, max_concurrency=4, requests_per_minute=None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self.semaphore:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            self.in_flight += 1
+            self.calls += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def stats(self):
+        return {"in_flight": self.in_flight, "calls": self.calls, "retries": self.retries,
+                "failures": self.failures}
+
+
+_provider_limits = {}
+
+
+def limits_for(provider, max_concurrency=4, requests_per_minute=None):
+    """ProviderLimits of a provider, created by its first client (later settings are ignored)"""
+    if provider not in _provider_limits:
+        _provider_limits[provider] = ProviderLimits(provider, max_concurrency, requests_per_minute)
+    return _provider_limits[provider]
+
+
+def new_http_client(max_concurrency=4, timeout=60):
+    """Pooled async HTTP client, keep-alive connections are reused across requests"""
+    return httpx.AsyncClient(timeout=timeout,
+                             limits=httpx.Limits(max_connections=max_concurrency,
+                                                 max_keepalive_connections=max_concurrency))
+
+
+def error_status(error):
+    """HTTP status of an SDK or httpx error, None if it has none"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    for name in ("status_code", "code"):
+        status = getattr(error, name, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_transient(error):
+    """Timeouts, dropped connections, rate limiting and server errors, retried with backoff"""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError,
+                          ConnectionError)):
+        return True
+    return error_status(error) in transient_statuses
+
+
+def retry_after(error):
+    """Seconds asked by a Retry-After header, None if absent"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers or "retry-after" not in headers:
+        return None
+    try:
+        return float(headers["retry-after"])
+    except ValueError:
+        return None
+
+
+def backoff_delay(error, attempt, base_delay=0.5, max_delay=8):
+    """Retry-After if the server sent one, else exponential backoff with jitter"""
+    return retry_after(error) or min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1)
+
+
+async def call_with_retries(limits: ProviderLimits, make_call, timeout=60, deadline=120, max_retries=3,
+                            base_delay=0.5, max_delay=8):
+    """
+    Run an LLM request under the provider limits, with exponential backoff on transient errors
+    Args:
+        limits: ProviderLimits of the provider
+        make_call: no-argument function returning a new awaitable of the request, called once per attempt
+        timeout: seconds per attempt
+        deadline: seconds for all attempts, waiting for a slot and backoff included
+        max_retries: attempts after the first one
+        base_delay: first backoff in seconds, doubled each retry (with jitter) up to max_delay
+
+    Returns:
+        result of the request
+
+    Raises:
+        TimeoutError: the deadline passed
+        the request's error if it is not transient or the retries are used up
+    """
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    attempt = 0
+    while True:
+        try:
+            async with limits.slot():
+                remaining = end - loop.time()
+                if remaining <= 0:
+                    raise TimeoutError(f"{limits.name} request exceeded its {deadline}s deadline")
+                return await asyncio.wait_for(make_call(), min(timeout, remaining))
+        except Exception as e:
+            delay = backoff_delay(e, attempt, base_delay, max_delay)
+            if attempt >= max_retries or not is_transient(e) or loop.time() + delay >= end:
+                limits.failures += 1
+                raise
+            attempt += 1
+            limits.retries += 1
+            logger.warning(f"{limits.name} request failed ({type(e).__name__}: {e}), retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def stream_with_retries(limits: ProviderLimits, make_stream, timeout=60, deadline=120, max_retries=3,
+                              base_delay=0.5, max_delay=8):
+    """
+    Streamed LLM request under the provider limits, chunks are yielded as they arrive
+    Args:
+        limits: ProviderLimits of the provider, the slot is held until the stream ends
+        make_stream: no-argument function returning a new async generator of text chunks, called once per attempt
+        timeout: seconds to wait for each chunk (the first one included)
+        deadline: seconds for the whole answer
+        max_retries: attempts after the first one, only before the first chunk (a partial answer is never
+                     repeated)
+        base_delay: first backoff in seconds, doubled each retry (with jitter) up to max_delay
+
+    Raises:
+        TimeoutError: a chunk took longer than timeout, or the deadline passed
+        the request's error if it is not transient, the retries are used up or the answer had started
+    """
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    attempt = 0
+    while True:
+        started = False
+        try:
+            async with limits.slot():
+                stream = make_stream()
+                try:
+                    while True:
+                        remaining = end - loop.time()
+                        if remaining <= 0:
+                            raise TimeoutError(f"{limits.name} request exceeded its {deadline}s deadline")
+                        try:
+                            chunk = await asyncio.wait_for(stream.__anext__(), min(timeout, remaining))
+                        except StopAsyncIteration:
+                            return
+                        started = True
+                        yield chunk
+                finally:
+                    await stream.aclose()  # closes the HTTP response, also when the consumer stops early
+        except Exception as e:
+            delay = backoff_delay(e, attempt, base_delay, max_delay)
+            if started or attempt >= max_retries or not is_transient(e) or loop.time() + delay >= end:
+                limits.failures += 1
+                raise
+            attempt += 1
+            limits.retries += 1
+            logger.warning(f"{limits.name} stream failed ({type(e).__name__}: {e}), retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
@@ -4,44 +4,126 @@ import ast
 from zhipuai import ZhipuAI
 
 
+from src.llms.async_client import limits_for, new_http_client, call_with_retries, stream_with_retries
 from src.utils.log import get_console_logger
 
 logger = get_console_logger('ChatGLM')
 
 
+class ThinkFilter:
+    """
+    Incremental version of text.split('</think>')[-1].strip() for streamed Z1 answers: everything up to the first
+    </think> is the reasoning trace and is held back (with or without an opening <think>), the answer after it is
+    passed on as it arrives, trailing whitespace held back until more text follows.
+    Same result as the split for any chunking when the text has at most one </think>. Later </think> tags are
+    passed on as answer text, dropping the answer before them would mean holding the whole answer back
+    """
+    close_tag = "</think>"
+
+    def __init__(self):
+        self.buffer = ""  # trace while thinking, then the trailing whitespace of the answer
+        self.thinking = True
+        self.started = False  # answer text emitted, leading whitespace already dropped
+
+    def _emit(self, text):
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
+    def feed(self, chunk):
+        """Answer text that can be shown after this chunk"""
+        self.buffer += chunk
+        if self.thinking:
+            end = self.buffer.find(self.close_tag)
+            if end < 0:
+                return ""
+            self.buffer = self.buffer[end + len(self.close_tag):]
+            self.thinking = False
+        text = self.buffer.rstrip()
+        self.buffer = self.buffer[len(text):]
+        return self._emit(text)
+
+    def flush(self):
+        """Held back text at the end of the stream, a trace that was never closed is the answer (as answer())"""
+        text, self.buffer = self.buffer, ""
+        return self._emit(text.strip()) if self.thinking else ""
+
+
+def check_think_filter(rounds=2000, seed=0):
+    """Compare ThinkFilter with the split of the whole text on random texts cut into random chunks"""
+    import random
+
+    rng = random.Random(seed)
+    pieces = ["<think>", "</think>", "</thi", "nk>", "<", "reasoning", "answer", " ", "\n", "a b"]
+    for _ in range(rounds):
+        text = "".join(rng.choices(pieces, k=rng.randint(0, 8)))
+        cuts = sorted(rng.sample(range(1, len(text)), min(rng.randint(0, 6), max(len(text) - 1, 0))))
+        chunks = [text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)])]
+        think_filter = ThinkFilter()
+        streamed = "".join(think_filter.feed(chunk) for chunk in chunks) + think_filter.flush()
+        if text.count("</think>") <= 1:
+            assert streamed == text.split('</think>')[-1].strip(), (chunks, streamed)
+        else:
+            assert streamed == text.split('</think>', 1)[1].strip(), (chunks, streamed)
+
+
+base_url = "https://open.bigmodel.cn/api/paas/v4"
+
+
 class ChatGLM():
     def __init__(self,
                  api_key = "",
                  model="glm-4-flash",
+                 max_concurrency=4,
+                 requests_per_minute=None,
+                 timeout=60,
+                 deadline=120,
+                 max_retries=3,
                  ) -> None:
+        """
+        Args:
+            api_key: ZhipuAI API key
+            model: model name
+            max_concurrency: requests in flight for all ChatGLM models of the process (aanswer)
+            requests_per_minute: rate limit for all ChatGLM models, none by default
+            timeout: seconds per attempt
+            deadline: seconds per answer, retries included (aanswer)
+            max_retries: retries of transient errors (aanswer)
+        """
 
         self.api_key = api_key
         if not self.api_key:
             raise ValueError("Must provide an API key")
 
         logger.info("Initializing remote ChatGLM client…")
-        self.client = ZhipuAI(api_key=self.api_key)
+        self.client = ZhipuAI(api_key=self.api_key, timeout=timeout)
         self.model = model
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.limits = limits_for("ChatGLM", max_concurrency, requests_per_minute)
+        self._http = None  # async client, created in the event loop that uses it
 
+    def warmup(self):
+        """One short completion, checks the key and the provider and opens the connection"""
         _ = self.client.chat.completions.create(
             model=self.model,
             messages=[{"role": "user", "content": "Hello"}],
         )
         logger.info("Remote ChatGLM ready.")
 
-    def answer(self, query: str, history):
+    @staticmethod
+    def _messages(query, history):
         messages = []
         if history:
             for q, a in history:
                 messages.append({"role": "user", "content": q})
                 messages.append({"role": "assistant", "content": a})
         messages.append({"role": "user", "content": query})
+        return messages
 
-        resp = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-        )
-        assistant_msg = resp.choices[0].message.content
+    def _reply(self, query, assistant_msg, history):
         if self.model == "glm-z1-flash":
             assistant_msg = assistant_msg.split('</think>')[-1].strip()
 
@@ -49,7 +131,85 @@ class ChatGLM():
         new_history.append([query, assistant_msg])
         return assistant_msg, new_history
 
+    def answer(self, query: str, history):
+        resp = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(query, history),
+        )
+        return self._reply(query, resp.choices[0].message.content, history)
+
+    async def aanswer(self, query: str, history):
+        """answer() without blocking the event loop, pooled connections, provider limits, retries and deadline"""
+        if self._http is None:
+            self._http = new_http_client(self.limits.max_concurrency, self.timeout)
+        payload = {"model": self.model, "messages": self._messages(query, history)}
+        headers = {"Authorization": "Bearer " + self.api_key}
+
+        async def request():
+            resp = await self._http.post(base_url + "/chat/completions", json=payload, headers=headers)
+            resp.raise_for_status()
+            return resp.json()
+
+        resp = await call_with_retries(self.limits, request, self.timeout, self.deadline, self.max_retries)
+        return self._reply(query, resp["choices"][0]["message"]["content"], history)
+
+    async def astream(self, query: str, history):
+        """
+        Answer text chunks as the model generates them (reasoning trace of the Z1 model filtered out), provider
+        limits, retries before the first chunk and deadline as aanswer
+        """
+        if self._http is None:
+            self._http = new_http_client(self.limits.max_concurrency, self.timeout)
+        payload = {"model": self.model, "messages": self._messages(query, history), "stream": True}
+        headers = {"Authorization": "Bearer " + self.api_key}
+
+        async def deltas():
+            async with self._http.stream("POST", base_url + "/chat/completions", json=payload,
+                                         headers=headers) as resp:
+                if resp.is_error:
+                    await resp.aread()
+                    resp.raise_for_status()
+                async for line in resp.aiter_lines():  # server-sent events, "data: {json}"
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+
+        think_filter = ThinkFilter() if self.model == "glm-z1-flash" else None
+        async for delta in stream_with_retries(self.limits, deltas, self.timeout, self.deadline, self.max_retries):
+            text = think_filter.feed(delta) if think_filter is not None else delta
+            if text:
+                yield text
+        if think_filter is not None:
+            text = think_filter.flush()
+            if text:
+                yield text
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
 if __name__ == "__main__":
+    check_think_filter()
+    print("ThinkFilter matches split('</think>')[-1].strip() on chunked input")
+
     llm = ChatGLM(api_key="xxx", model="glm-z1-flash")
+    llm.warmup()
     msg, _ = llm.answer("Hello", [])
-    print(msg)
\ No newline at end of file
+    print(msg)
+
+    import asyncio
+
+    async def main():
+        replies = await asyncio.gather(*(llm.aanswer(f"Say {i}", []) for i in range(8)))
+        print([reply for reply, _ in replies], llm.limits.stats())
+        async for text in llm.astream("Count to 20", []):
+            print(text, end="", flush=True)
+        await llm.aclose()
+
+    asyncio.run(main())
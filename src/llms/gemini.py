@@ -2,18 +2,40 @@ from src.utils.log import get_console_logger
 from google import genai
 from google.genai import types
 
+from src.llms.async_client import limits_for, call_with_retries, stream_with_retries
+
 logger = get_console_logger('Gemini')
 
 class Gemini:
-    def __init__(self, api_key: str = None, model: str = "gemini-2.0-flash") -> None:
+    def __init__(self, api_key: str = None, model: str = "gemini-2.0-flash", max_concurrency: int = 4,
+                 requests_per_minute: int = None, timeout: float = 60, deadline: float = 120,
+                 max_retries: int = 3) -> None:
+        """
+        Args:
+            api_key: Gemini API key
+            model: model name
+            max_concurrency: requests in flight for all Gemini models of the process (aanswer)
+            requests_per_minute: rate limit for all Gemini models, none by default
+            timeout: seconds per attempt
+            deadline: seconds per answer, retries included (aanswer)
+            max_retries: retries of transient errors (aanswer)
+        """
         self.api_key = api_key
         if not self.api_key:
             raise ValueError("Must provide an API key")
 
-        self.client = genai.Client(api_key=self.api_key)
+        # one client, its sync and async (client.aio) sides keep their connections open
+        self.client = genai.Client(api_key=self.api_key,
+                                   http_options=types.HttpOptions(timeout=int(timeout * 1000)))
         self.model = model
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.limits = limits_for("Gemini", max_concurrency, requests_per_minute)
         logger.info("Initializing remote Gemini client…")
 
+    def warmup(self):
+        """One short completion, checks the key and the provider and opens the connection"""
         try:
             response = self.client.models.generate_content(
                 model=self.model, contents="Hi!"
@@ -23,14 +45,18 @@ class Gemini:
             logger.error(f"Failed to initialize Gemini: {e}")
             raise
 
+    @staticmethod
+    def _config(history):
+        return types.GenerateContentConfig(
+            system_instruction=history[0]['content'],
+            temperature=0.1
+        )
+
     def answer(self, query: str, history=None):
         try:
             response = self.client.models.generate_content(
                 model=self.model, contents=query,
-                config=types.GenerateContentConfig(
-                    system_instruction=history[0]['content'],
-                    temperature=0.1
-                )
+                config=self._config(history)
             )
         except Exception as e:
             logger.error(f"Failed to initialize Gemini: {e}")
@@ -39,6 +65,39 @@ class Gemini:
         assistant_msg = [candidate.content.parts[0].text for candidate in response.candidates][0]
         return assistant_msg, []
 
+    async def aanswer(self, query: str, history=None):
+        """answer() without blocking the event loop, provider limits, retries and deadline"""
+        try:
+            response = await call_with_retries(
+                self.limits,
+                lambda: self.client.aio.models.generate_content(model=self.model, contents=query,
+                                                                config=self._config(history)),
+                self.timeout, self.deadline, self.max_retries)
+        except Exception as e:
+            logger.error(f"Gemini request failed: {e}")
+            raise
+
+        assistant_msg = [candidate.content.parts[0].text for candidate in response.candidates][0]
+        return assistant_msg, []
+
+    async def astream(self, query: str, history=None):
+        """Answer text chunks as the model generates them, provider limits, retries before the first chunk and
+        deadline as aanswer"""
+        async def chunks():
+            stream = await self.client.aio.models.generate_content_stream(model=self.model, contents=query,
+                                                                          config=self._config(history))
+            async for chunk in stream:
+                if chunk.text:
+                    yield chunk.text
+
+        try:
+            async for text in stream_with_retries(self.limits, chunks, self.timeout, self.deadline,
+                                                  self.max_retries):
+                yield text
+        except Exception as e:
+            logger.error(f"Gemini stream failed: {e}")
+            raise
+
 
 if __name__ == "__main__":
     startup_prompt = [
@@ -47,5 +106,6 @@ if __name__ == "__main__":
         {"role": "assistant", "content": "Sure, please send me your query and data."},
     ]
     client = Gemini(api_key="xxx")
+    client.warmup()
     reply, hist = client.answer("Hi Gemini!", history=startup_prompt)
     print("Gemini:", reply)
@@ -0,0 +1,113 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.log import get_console_logger
+
+logger = get_console_logger('Providers')
+
+# Provider states
+idle, starting, ready, failed = "not started", "starting", "ready", "failed"
+
+
+class ProviderRegistry:
+    """
+    LLM clients by name, created and warmed up in background threads instead of at startup.
+    A provider that is down only makes its own model unavailable, and it is tried again after retry_after seconds
+    """
+
+    def __init__(self, retry_after=30):
+        """
+        Args:
+            retry_after: seconds before a provider whose warmup failed is tried again
+        """
+        self.retry_after = retry_after
+        self.factories = {}  # name -> function creating the client
+        self.clients = {}
+        self.states = {}
+        self.errors = {}
+        self.failed_at = {}
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-warmup")
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        """
+        Args:
+            name: model name shown in the UI
+            factory: no-argument function returning the client (ChatGLM, Gemini...), called in a background thread
+        """
+        with self._lock:
+            self.factories[name] = factory
+            self.states[name] = idle
+
+    def names(self):
+        return list(self.factories)
+
+    def _start(self, name):
+        """Warm a provider up in the background unless it is ready, starting, or failed recently. Holds the lock"""
+        state = self.states[name]
+        if state in (ready, starting):
+            return
+        if state == failed and time.monotonic() - self.failed_at[name] < self.retry_after:
+            return
+        self.states[name] = starting
+        self._executor.submit(self._warmup, name)
+
+    def _warmup(self, name):
+        start = time.perf_counter()
+        try:
+            client = self.clients.get(name) or self.factories[name]()
+            with self._lock:
+                self.clients[name] = client
+            client.warmup()
+        except Exception as e:
+            with self._lock:
+                self.states[name] = failed
+                self.errors[name] = f"{type(e).__name__}: {e}"
+                self.failed_at[name] = time.monotonic()
+            logger.error(f"{name} unavailable ({type(e).__name__}: {e}), retrying after {self.retry_after}s")
+            return
+        with self._lock:
+            self.states[name] = ready
+            self.errors.pop(name, None)
+        logger.info(f"{name} ready in {time.perf_counter() - start:.1f}s")
+
+    def warmup_all(self):
+        """Warm every provider up concurrently in the background, returns at once"""
+        with self._lock:
+            for name in self.factories:
+                self._start(name)
+
+    def get(self, name):
+        """
+        Client of a ready provider
+        Returns:
+            the client, None if it is not ready yet (its warmup is started) or unavailable
+        Raises:
+            KeyError: the name was never registered
+        """
+        with self._lock:
+            if self.states[name] == ready:
+                return self.clients[name]
+            self._start(name)
+            return None
+
+    def state(self, name):
+        """State of a provider, with the error of a failed warmup"""
+        with self._lock:
+            state = self.states[name]
+            return f"{state} ({self.errors[name]})" if state == failed else state
+
+    def status(self):
+        """{name: state} of all providers"""
+        return {name: self.state(name) for name in self.names()}
+
+    def wait(self, timeout=None):
+        """Block until no provider is starting, for scripts; True if all are ready"""
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                states = list(self.states.values())
+            if starting not in states or (end is not None and time.monotonic() >= end):
+                return all(state == ready for state in states)
+            time.sleep(0.1)
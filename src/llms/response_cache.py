@@ -0,0 +1,60 @@
+import json
+import time
+import hashlib
+
+from src.embeddings.cache import normalize_text
+from src.utils.kvstore import SqliteLRU
+
+
+def normalize_question(question: str) -> str:
+    """normalize_text and case folded, "What is X?" and "what is  x?" share one entry"""
+    return normalize_text(question).casefold()
+
+
+class ResponseCache:
+    """
+    Exact-match cache of LLM answers, keyed by (model, system prompt, normalized question, retrieved object ids,
+    knowledge base version). Keys start with the knowledge base name, so the answers of a re-ingested knowledge
+    base can be dropped at once; they would not be hit anyway, the version is part of the key
+    """
+
+    def __init__(self, path, max_bytes=256 << 20, ttl=7 * 24 * 3600):
+        """
+        Args:
+            path: sqlite file of the cache
+            max_bytes: size cap, least recently used answers are evicted first
+            ttl: seconds an answer is reused, None for no expiry
+        """
+        self.store = SqliteLRU(path, max_bytes=max_bytes, ttl=ttl)
+
+    @staticmethod
+    def key(kb_name, kb_version, model, system_prompt, question, object_ids):
+        """
+        Args:
+            kb_name: knowledge base searched, "" if none
+            kb_version: its folder hash, None if unknown
+            model: provider and model name, e.g. "ChatGLM:glm-4-flash"
+            system_prompt: instruction sent with every question
+            question: user question, normalized
+            object_ids: retrieved object ids in rank order (same ids and order give the same prompt)
+        """
+        digest = hashlib.sha256(json.dumps([model, system_prompt, normalize_question(question), list(object_ids)],
+                                           ensure_ascii=False).encode('utf-8')).hexdigest()
+        return f"{kb_name}:{kb_version or ''}:{digest}"
+
+    def get(self, key):
+        """Cached answer, None on a miss or if it expired"""
+        value = self.store.get(key)
+        return None if value is None else json.loads(value)["answer"]
+
+    def put(self, key, answer):
+        self.store.put(key, json.dumps({"answer": answer, "created": time.time()}, ensure_ascii=False)
+                       .encode('utf-8'))
+
+    def invalidate(self, kb_name):
+        """Drop the answers of a knowledge base, e.g. after it was re-ingested. Returns the number removed"""
+        return self.store.delete_prefix(kb_name + ":")
+
+    def stats(self):
+        """hits, misses, hit_rate, entries, bytes"""
+        return self.store.stats()
@@ -0,0 +1,134 @@
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import faiss  # faiss-cpu
+
+
+class SemanticCacheEntry:
+    __slots__ = ("question", "terms", "object_ids", "search_res", "answer", "created")
+
+    def __init__(self, question, terms, object_ids, search_res, answer):
+        self.question = question
+        self.terms = terms
+        self.object_ids = list(object_ids)
+        self.search_res = search_res
+        self.answer = answer
+        self.created = time.time()
+
+
+class KnowledgeBaseCache:
+    """Past questions of one knowledge base and model: inner product index of their normalized embeddings"""
+
+    def __init__(self, version, dim):
+        self.version = version
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.entries = OrderedDict()  # entry id -> SemanticCacheEntry, least recently used first
+        self.next_id = 0
+
+
+class SemanticCache:
+    """
+    Answers of past questions, reused for paraphrases ("March sales total" / "total sales for March 2025"):
+    a new question whose embedding has cosine similarity >= threshold with a cached one gets its answer, unless both
+    mention known tags or dates and these differ (embeddings of "March 2025 sales" and "April 2025 sales" are close).
+    In memory, one small FAISS index per (knowledge base, model), reset when the knowledge base version changes
+    """
+
+    def __init__(self, threshold=0.95, max_entries=1000, ttl=None):
+        """
+        Args:
+            threshold: minimum cosine similarity between question embeddings for a hit
+            max_entries: questions kept per knowledge base and model, least recently used are dropped
+            ttl: seconds an answer is reused, None for no expiry
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.caches = {}  # (knowledge base, model) -> KnowledgeBaseCache
+        self.lookups = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalized(embedding):
+        vector = np.array(embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _cache(self, kb_name, model, version, dim):
+        """Cache of a knowledge base and model, emptied if it holds answers of another version"""
+        cache = self.caches.get((kb_name, model))
+        if cache is None or cache.version != version:
+            cache = self.caches[(kb_name, model)] = KnowledgeBaseCache(version, dim)
+        return cache
+
+    def lookup(self, kb_name, model, version, embedding, terms=()):
+        """
+        Closest cached question
+        Args:
+            kb_name: knowledge base searched, "" if none
+            model: provider and model name, answers of other models are not returned
+            version: knowledge base version (folder hash), cached answers of other versions are dropped
+            embedding: query embedding (FaissIdx.embed_queries)
+            terms: tags and dates of the knowledge base mentioned by the question (TagIndex.match)
+
+        Returns:
+            (SemanticCacheEntry, similarity) of a hit, None on a miss
+        """
+        vector = self._normalized(embedding)
+        with self._lock:
+            self.lookups += 1
+            cache = self._cache(kb_name, model, version, vector.shape[1])
+            if not cache.entries:
+                return None
+            terms = tuple(sorted(terms))
+            scores, ids = cache.index.search(vector, min(8, len(cache.entries)))
+            for entry_id, similarity in zip(ids[0].tolist(), scores[0].tolist()):
+                if entry_id < 0 or similarity < self.threshold:
+                    break
+                entry = cache.entries[entry_id]
+                if self.ttl is not None and time.time() - entry.created > self.ttl:
+                    self._remove(cache, [entry_id])
+                    continue
+                if entry.terms and terms and entry.terms != terms:  # a question naming no tag does not conflict
+                    continue
+                cache.entries.move_to_end(entry_id)
+                self.hits += 1
+                return entry, similarity
+            return None
+
+    def add(self, kb_name, model, version, embedding, question, object_ids, search_res, answer, terms=()):
+        """Cache the answer of a question, with the ids and text of the documents it was given"""
+        vector = self._normalized(embedding)
+        with self._lock:
+            cache = self._cache(kb_name, model, version, vector.shape[1])
+            entry_id = cache.next_id
+            cache.next_id += 1
+            cache.index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+            cache.entries[entry_id] = SemanticCacheEntry(question, tuple(sorted(terms)), object_ids,
+                                                         search_res, answer)
+            if len(cache.entries) > self.max_entries:
+                self._remove(cache, list(cache.entries)[:len(cache.entries) - self.max_entries])
+
+    @staticmethod
+    def _remove(cache, entry_ids):
+        cache.index.remove_ids(np.array(entry_ids, dtype=np.int64))
+        for entry_id in entry_ids:
+            del cache.entries[entry_id]
+
+    def invalidate(self, kb_name):
+        """Drop the cached answers of a knowledge base (all models), returns the number removed"""
+        with self._lock:
+            keys = [key for key in self.caches if key[0] == kb_name]
+            removed = sum(len(self.caches[key].entries) for key in keys)
+            for key in keys:
+                del self.caches[key]
+        return removed
+
+    def stats(self):
+        with self._lock:
+            entries = {f"{kb_name}/{model}": len(cache.entries) for (kb_name, model), cache in self.caches.items()}
+        return {"lookups": self.lookups, "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0, "entries": entries}
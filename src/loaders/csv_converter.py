@@ -1,8 +1,14 @@
 import csv
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-from src.loaders.doc2table import doc2table
-from src.loaders.tags import load_tags
-from src.loaders.file import File
+from src.loaders.doc2table import doc2table, extract_file, add_content_tags
+from src.loaders.tags import load_tags, read_tags_file
+from src.loaders.file import File, read_documents_file
+from src.loaders.object import read_objects_file, object_file_id
+from src.loaders.records import objects_records_name, documents_records_name, tags_records_name, write_records
+from src.utils.hash import build_manifest
 
 import os
 
@@ -45,11 +51,102 @@ def write_to_csv(elements, csv_path):
     file.close()
 
 
-def folder_to_csv(input_path):
+def write_csv_files(documents, objects, tags, document_path, object_path, tag_path):
+    """Rewrite the three csv files of a knowledge base"""
+    init_csv_files(document_path, object_path, tag_path)
+    write_to_csv(documents, document_path)
+    write_to_csv(objects, object_path)
+    tags.to_csv(tag_path)
+
+
+def write_records_files(output_path, documents, objects, tags):
+    """Rewrite the three typed JSON lines files of a knowledge base, read back by read_*_file"""
+    write_records(os.path.join(output_path, documents_records_name), (doc.to_record() for doc in documents))
+    write_records(os.path.join(output_path, objects_records_name), (obj.to_record() for obj in objects))
+    write_records(os.path.join(output_path, tags_records_name), tags.to_records())
+
+
+def list_input_files(input_path, manifest):
     """
-    Extract texts/tables from all files in the folder，and output a csv to data/outputdata with the same folder name
+    doc/docx Files of a knowledge base, subfolders included
     Args:
-        input_path: input path
+        input_path: knowledge base folder
+        manifest: build_manifest() of the folder, gives stable file ids
+
+    Returns:
+        {relative path: File}
+    """
+    return {relpath: File(file_id=entry["file_id"], file_path=os.path.join(input_path, relpath))
+            for relpath, entry in manifest["files"].items()}
+
+
+def _init_worker():
+    """Worker processes need their own COM apartment for doc -> docx conversion"""
+    import pythoncom
+    pythoncom.CoInitialize()
+
+
+def iter_extract_files(file_list, tags, workers=1):
+    """
+    Extract files and tag their objects, one file at a time
+    Args:
+        file_list: Files to extract
+        tags: Tags, updated in file order
+        workers: > 1 parses files in a process pool, only content tagging runs in this process,
+                 in file order, so the result does not depend on the number of workers.
+                 At most 2 * workers files are parsed ahead of the consumer
+
+    Yields:
+        Object list of each file, tables then texts, in file order
+    """
+    if workers <= 1 or len(file_list) <= 1:
+        for file in file_list:
+            print("Processing file：", file.file_path)
+            tables, texts = doc2table(file, tags)
+            yield tables + texts
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        # futures are consumed in file order, object ids are scoped by file id so they don't depend on the worker
+        pending = deque()
+        files = iter(file_list)
+        for file in itertools.islice(files, 2 * workers):
+            pending.append((file, pool.submit(extract_file, file)))
+        while pending:
+            file, future = pending.popleft()
+            tables, texts = future.result()
+            for next_file in itertools.islice(files, 1):
+                pending.append((next_file, pool.submit(extract_file, next_file)))
+            print("Processed file：", file.file_path)
+            add_content_tags(tables, texts, tags)
+            yield tables + texts
+
+
+def extract_files(file_list, tags, workers=1):
+    """
+    Extract files and tag their objects
+    Args:
+        file_list: Files to extract
+        tags: Tags, updated in file order
+        workers: number of processes parsing files, see iter_extract_files
+
+    Returns:
+        Object list, tables then texts of each file in file order
+    """
+    objects = []
+    for file_objects in iter_extract_files(file_list, tags, workers):
+        objects += file_objects
+    return objects
+
+
+def init_output_folder(input_path):
+    """
+    Initialize outputdata folder
+    Args:
+        input_path: knowledge base folder under data/inputdata
+
+    Returns:
+        Folder with the same name under data/outputdata
     """
     folder_names = input_path.split('\\')  # os.splitext process '.'
     data_folder = ''
@@ -60,32 +157,52 @@ def folder_to_csv(input_path):
 
     output_path = data_folder + 'outputdata\\' + folder_names[-1]
     os.makedirs(output_path, exist_ok=True)
+    return output_path
+
+
+def folder_to_csv(input_path, manifest=None, update_files=None, drop_file_ids=(), workers=1):
+    """
+    Extract texts/tables from all files in the folder，and output typed JSON lines files (read back by later steps)
+    and csv exports to data/outputdata with the same folder name
+    Args:
+        input_path: input path
+        manifest: build_manifest() of the folder, built here if not given
+        update_files: relative paths of added/changed files; if given and the csv files exist, only these
+                      files are extracted and the rows of all other files are kept
+        drop_file_ids: file ids whose rows are removed (deleted files)
+        workers: number of processes parsing files, 1 extracts in this process
+    """
+    output_path = init_output_folder(input_path)
 
     document_csv_path = os.path.join(output_path, documents_csv_name)
     object_csv_path = os.path.join(output_path, objects_csv_name)
     tag_csv_path = os.path.join(output_path, tags_csv_name)
 
-    init_csv_files(document_csv_path, object_csv_path, tag_csv_path)
-
-    file_list = []
-    for files in os.walk(input_path):  # loop subfolders
-        for file in files[2]:
-            if os.path.splitext(file)[1].lower() == '.doc' or os.path.splitext(file)[1].lower() == '.docx':
-                file = File(file_path=os.path.join(input_path, file))
-                file_list.append(file)
-
-    write_to_csv(file_list, document_csv_path)
-
-    # load tags
-    tags = load_tags()
-    for file in file_list:
-        print("Processing file：", file.file_path)
-        tables, texts = doc2table(file, tags)
-        elements = tables + texts
-        write_to_csv(elements, object_csv_path)
-
-    # write tags
-    tags.to_csv(tag_csv_path)
+    if manifest is None:
+        manifest = build_manifest(input_path)
+    input_files = list_input_files(input_path, manifest)
+
+    extracted = os.path.exists(os.path.join(output_path, objects_records_name)) or os.path.exists(object_csv_path)
+    if update_files is None or not extracted:  # extract everything
+        file_list = list(input_files.values())
+        documents, objects, tags = file_list, [], load_tags()
+    else:  # incremental, keep rows of unchanged files
+        file_list = [input_files[relpath] for relpath in update_files]
+        dropped = set(drop_file_ids) | {file.file_id for file in file_list}
+
+        documents = [doc for doc in read_documents_file(output_path) if doc.file_id not in dropped] + file_list
+        objects = [obj for obj in read_objects_file(output_path) if object_file_id(obj.object_id) not in dropped]
+        tags = read_tags_file(output_path)
+        for tag in tags.tags_dict:
+            tags.tags_dict[tag] = {object_id for object_id in tags.tags_dict[tag]
+                                   if object_file_id(object_id) not in dropped}
+        for tag in load_tags().tags_dict:  # local tags without related objects are not in tags.csv
+            tags.add_tag(tag)
+
+    objects += extract_files(file_list, tags, workers)
+
+    write_records_files(output_path, documents, objects, tags)
+    write_csv_files(documents, objects, tags, document_csv_path, object_csv_path, tag_csv_path)
 
 
 if __name__ == "__main__":
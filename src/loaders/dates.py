@@ -0,0 +1,133 @@
+import os
+import re
+import datetime
+
+from dateparser.search import search_dates
+from dateparser.languages.loader import default_loader
+
+date_format = "%B %Y"
+search_settings = {"PREFER_DAY_OF_MONTH": "first"}
+
+months = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october",
+          "november", "december"]
+month_numbers = {name: i + 1 for i, name in enumerate(months)}
+month_numbers.update({name[:3]: i + 1 for i, name in enumerate(months)})
+month_numbers["sept"] = 9
+
+# "February 2025", "Feb. 2025"
+month_year_pattern = re.compile(r"\b(" + "|".join(sorted(month_numbers, key=len, reverse=True)) +
+                                r")\.?,?\s+((?:19|20)\d\d)\b", re.IGNORECASE)
+# Anything else dateparser could read as a date: digits, month/weekday names, relative words
+date_hint_pattern = re.compile(
+    r"\d|\b(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|"
+    r"sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?|"
+    r"mon(?:day)?|tue(?:s(?:day)?)?|wed(?:nesday)?|thu(?:r(?:s(?:day)?)?)?|fri(?:day)?|sat(?:urday)?|sun(?:day)?|"
+    r"today|tomorrow|yesterday|tonight|now|ago|noon|midnight|morning|afternoon|evening|night|"
+    r"(?:sec(?:ond)?|min(?:ute)?|hour|hr|day|week|fortnight|month|year|yr|decade)s?)\b",
+    re.IGNORECASE)
+word_pattern = re.compile(r"[a-z]+", re.IGNORECASE)
+# Locale entries whose words search_dates can read as (part of) a date
+date_word_keys = months + ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday", "am", "pm",
+                           "year", "month", "week", "day", "hour", "minute", "second", "decade", "ago", "in"]
+
+
+def load_date_words():
+    """
+    Words of all dateparser locales that search_dates can read as a date, e.g. "we" (Wednesday), "a"/"an" (1),
+    "to" (Danish Thursday), "set" (Catalan September)
+    Returns:
+        set of lowercase words
+    """
+    date_words = set()
+    for locale in default_loader.get_locales():
+        info = locale.info
+        phrases = [phrase for key in date_word_keys for phrase in info.get(key, [])]
+        phrases += [phrase for values in info.get("relative-type", {}).values() for phrase in values]
+        phrases += [phrase for simplification in info.get("simplifications", []) for phrase in simplification]
+        for phrase in phrases:
+            date_words.update(word.lower() for word in word_pattern.findall(phrase))
+    return date_words
+
+
+class DateTagger:
+    """
+    "%B %Y" date tags of objects, from search_dates on the content or else on the file title.
+    ASCII text goes through a regex prefilter first: text without anything date-like has no date,
+    text whose only dates are "<month> <year>" is answered directly. Everything else (a month without year,
+    other numbers, relative dates, non-ASCII text) falls back to search_dates, so tags are the same as without
+    the prefilter. search_dates also reads plain words as dates ("we" -> Wednesday, "an" -> a month of this year,
+    "to" in other languages), text with any word of a dateparser locale counts as date-like.
+    Title results are cached per file
+    """
+
+    def __init__(self):
+        self.date_words = None  # loaded on first use, reading all dateparser locales takes ~0.5s
+        self.title_tags = {}  # file name -> date tag of its title
+        self.fast = 0
+        self.fallback = 0
+
+    def search(self, text):
+        """
+        Date tag of a text, the last date found like search_dates
+        Args:
+            text: text to scan
+
+        Returns:
+            "%B %Y" date tag, None if no date is found
+        """
+        if text.isascii():
+            if self.date_words is None:
+                self.date_words = load_date_words()
+            matches = month_year_pattern.findall(text)
+            rest = month_year_pattern.sub(" ", text)
+            if not date_hint_pattern.search(rest) and self.date_words.isdisjoint(
+                    word.lower() for word in word_pattern.findall(rest)):
+                self.fast += 1
+                if not matches:
+                    return None
+                month, year = matches[-1]
+                return datetime.date(int(year), month_numbers[month.lower()], 1).strftime(date_format)
+
+        self.fallback += 1
+        result = search_dates(text, settings=search_settings)
+        if not result:
+            return None
+        return result[-1][1].strftime(date_format)
+
+    def title_tag(self, file_name):
+        """Date tag of a file title, e.g. 'January_2025_Sales_Report' -> 'January 2025'"""
+        if file_name not in self.title_tags:
+            title = os.path.splitext(os.path.split(file_name)[-1])[0].replace("_", " ")
+            self.title_tags[file_name] = self.search(title)
+        return self.title_tags[file_name]
+
+    def find(self, file_name, content):
+        """
+        Date tag of an object, from its content or else from its file title
+        Args:
+            file_name: file name of the object
+            content: content that needs tagging
+
+        Returns:
+            "%B %Y" date tag, None if no date is found
+        """
+        content_tag = self.search(content)
+        if content_tag is not None:
+            return content_tag
+        return self.title_tag(file_name)
+
+    def stats(self):
+        return {"fast": self.fast, "fallback": self.fallback, "cached_titles": len(self.title_tags)}
+
+
+date_tagger = DateTagger()
+
+
+if __name__ == "__main__":
+    for text in ["January_2025_Sales_Report", "In February, the grocery department", "Sales fell 3% last week",
+                 "Revenue report for Sept. 2024", "No dates here", "Grocery Department", "Units Sold",
+                 "Sales figures we collected", "An increase over February 2025"]:
+        fast = date_tagger.search(text)
+        result = search_dates(text, settings=search_settings)
+        print(repr(text), fast, result[-1][1].strftime(date_format) if result else None)
+    print(date_tagger.stats())
@@ -1,6 +1,7 @@
-from src.loaders.object import Object
+from src.loaders.object import Object, file_object_ids
 from src.loaders.file import File
 from src.loaders.tags import load_tags, Tags
+from src.loaders.dates import date_tagger
 
 import os
 import re
@@ -8,7 +9,6 @@ import pandas as pd
 import docx.table  # docx is in python-docx
 from win32com import client
 import dateparser
-from dateparser.search import search_dates
 
 from docx.document import Document as _Document
 from docx.oxml.text.paragraph import CT_P
@@ -128,13 +128,24 @@ def add_text_content_tags(text: Object, tags: Tags):
         text: text Object needed for tagging
         tags: Tags
     """
-    tags_in_text = set()
-    for tag in tags.tags_dict:
-        if tag in text.content:
-            tags.add_tag(tag, text.object_id)
-            tags_in_text.add(tag)
+    tags_in_text = tags.find_in(text.content)
+    for tag in tags_in_text:
+        tags.add_tag(tag, text.object_id)
     text.tags = tags_in_text
 
+def find_date_tag(object: Object, content: str):
+    """
+    Find the date tag of an Object, from its content or else from its file title
+    Args:
+        object: Object
+        content: content that needs tagging
+
+    Returns:
+        "%B %Y" date tag, None if no date is found
+    """
+    return date_tagger.find(object.file_name, content)
+
+
 def add_date_tags(object: Object, tags: Tags, content: str):
     """
     Add date tags to Object
@@ -143,28 +154,10 @@ def add_date_tags(object: Object, tags: Tags, content: str):
         tags: Tags
         content: content that needs tagging
     """
-    file_path = os.path.split(object.file_name)
-    title = os.path.splitext(file_path[-1])[0].replace("_", " ")
-
-    time_tag_title = None
-    time_tag_content = None
-
-    result_title = search_dates(title, settings={"PREFER_DAY_OF_MONTH": "first"})
-    if result_title:
-        for _, dt in result_title:
-            time_tag_title = dt.strftime("%B %Y")
-
-    result_content = search_dates(content, settings={"PREFER_DAY_OF_MONTH": "first"})
-    if  result_content:
-        for _, dt in result_content:
-            time_tag_content = dt.strftime("%B %Y")
-
-    if result_content:
-        tags.add_tag(time_tag_content, object.object_id)
-        object.date.add(time_tag_content)
-    elif result_title:
-        tags.add_tag(time_tag_title, object.object_id)
-        object.date.add(time_tag_title)
+    time_tag = find_date_tag(object, content)
+    if time_tag is not None:
+        tags.add_tag(time_tag, object.object_id)
+        object.date.add(time_tag)
 
 
 def find_table_contexts(texts, table_num, above_range=1, below_range=1):
@@ -272,38 +265,71 @@ def find_title(texts: list) -> str:
         return ""
 
 
-def add_tags_and_contexts(tables, texts, elements, tags: Tags):
+def add_contexts_and_dates(tables, texts, elements):
     """
-    Add tags and context for tables and texts
+    Add contexts and dates for tables and texts, without touching Tags (can run in a worker process)
     Args:
         tables: list of tables
         texts: list of texts
         elements: all elements
-        tags: Tags
     """
     for table in tables:
         tb_num = table.position
         above_context, below_context = find_table_contexts(elements, tb_num, 1, 1)
         table.above = above_context[0] if above_context else ""  # Assume range 1
         table.below = below_context[0] if below_context else ""
-        add_table_content_tags(table, tags)
-        add_date_tags(table, tags, table.title)
+        time_tag = find_date_tag(table, table.title)
+        if time_tag is not None:
+            table.date.add(time_tag)
 
     for text in texts:
         tx_num = text.position
         above_context, below_context = find_text_contexts(elements, tx_num, 1, 1)
         text.above = above_context[0] if above_context else ""
         text.below = below_context[0] if below_context else ""
+        time_tag = find_date_tag(text, text.content)
+        if time_tag is not None:
+            text.date.add(time_tag)
+
+
+def add_content_tags(tables, texts, tags: Tags):
+    """
+    Add content tags for tables and texts and register their dates, in file order
+    Args:
+        tables: list of tables, dates already found by add_contexts_and_dates
+        texts: list of texts, dates already found by add_contexts_and_dates
+        tags: Tags
+    """
+    for table in tables:
+        add_table_content_tags(table, tags)
+        for time_tag in table.date:
+            tags.add_tag(time_tag, table.object_id)
+
+    for text in texts:
         add_text_content_tags(text, tags)
-        add_date_tags(text, tags, text.content)
+        for time_tag in text.date:
+            tags.add_tag(time_tag, text.object_id)
 
 
-def doc2table(file: File, tags: Tags) -> tuple[list[Object], list]:
+def add_tags_and_contexts(tables, texts, elements, tags: Tags):
     """
-    Scan all tables and texts in docx
+    Add tags and context for tables and texts
     Args:
-        file: docx File that needs processing
+        tables: list of tables
+        texts: list of texts
+        elements: all elements
         tags: Tags
+    """
+    add_contexts_and_dates(tables, texts, elements)
+    add_content_tags(tables, texts, tags)
+
+
+def extract_file(file: File) -> tuple[list[Object], list]:
+    """
+    Scan all tables and texts in docx, with contexts and dates but without content tags.
+    Uses no shared state, so files can be extracted in worker processes
+    Args:
+        file: docx File that needs processing
 
     Returns:
         (tables, texts)
@@ -326,6 +352,7 @@ def doc2table(file: File, tags: Tags) -> tuple[list[Object], list]:
     docx_all_texts = []
     docx_all_tables = []
     docx_all_elements = []
+    object_ids = file_object_ids(file.file_id)
 
     block_idx = 0
     for block in iter_block_items(docx_file):
@@ -333,7 +360,7 @@ def doc2table(file: File, tags: Tags) -> tuple[list[Object], list]:
             if block.text == '':  # Skip empty
                 continue
             text = block.text.replace('\t', '').strip()
-            text_object = Object(file_id=file.file_id, file_name=file_name,
+            text_object = Object(object_id=next(object_ids), file_id=file.file_id, file_name=file_name,
                                 position=block_idx, title="", content=text)
             docx_all_texts.append(text_object)
             docx_all_elements.append(text)
@@ -349,13 +376,13 @@ def doc2table(file: File, tags: Tags) -> tuple[list[Object], list]:
                 dataframe = pd.DataFrame(table[1:], columns=table[0])
                 dict_table = dataframe.to_dict("dict")
 
-                table = Object(file_id=file.file_id, file_name=file_name, position=block_idx,
+                table = Object(object_id=next(object_ids), file_id=file.file_id, file_name=file_name, position=block_idx,
                                      title=title, content=dict_table)
                 docx_all_tables.append(table)
                 docx_all_elements.append(f"<Table:{table.object_id}>")
                 block_idx += 1
 
-    add_tags_and_contexts(docx_all_tables, docx_all_texts, docx_all_elements, tags)
+    add_contexts_and_dates(docx_all_tables, docx_all_texts, docx_all_elements)
 
     if recycle_flag:
         os.remove(recycle_name)
@@ -363,6 +390,21 @@ def doc2table(file: File, tags: Tags) -> tuple[list[Object], list]:
     return docx_all_tables, docx_all_texts
 
 
+def doc2table(file: File, tags: Tags) -> tuple[list[Object], list]:
+    """
+    Scan all tables and texts in docx
+    Args:
+        file: docx File that needs processing
+        tags: Tags
+
+    Returns:
+        (tables, texts)
+    """
+    tables, texts = extract_file(file)
+    add_content_tags(tables, texts, tags)
+    return tables, texts
+
+
 if __name__ == "__main__":
     tags = load_tags()
     file = File(file_path=
@@ -4,6 +4,9 @@ import ast
 
 import numpy as np
 
+from src.storages.vector_store import VectorStore
+from src.loaders.records import documents_records_name, iter_records, has_records
+
 
 class File:
     _id = 0
@@ -20,13 +23,21 @@ class File:
     def to_list(self):
         return [self.file_id, self.file_path]
 
+    def to_record(self):
+        """for documents.jsonl"""
+        return {"file_id": self.file_id, "file_path": self.file_path}
+
 
 class EmbeddedFile(File):
     def __init__(self, file_id=None, file_path=np.ndarray):
         super().__init__(file_id=file_id, file_path=file_path)
 
     def to_list(self):
-        return [self.file_id, np.array2string(self.file_path, separator=',', max_line_width=100000)]
+        """for csv conversion, vectors are stored separately by vectors()"""
+        return [self.file_id]
+
+    def vectors(self):
+        return {"file_path": self.file_path}
 
 
 def read_documents_csv(input_path, csv_name="documents.csv"):
@@ -54,9 +65,60 @@ def read_documents_csv(input_path, csv_name="documents.csv"):
     return documents
 
 
+def read_documents_jsonl(input_path, file_name=documents_records_name):
+    """
+    Read documents.jsonl in target folder, and save to File
+    Args:
+        input_path: input folder
+        file_name: records filename, documents.jsonl by default
+
+    Returns:
+        File list
+    """
+    return [File(file_id=record["file_id"], file_path=record["file_path"])
+            for record in iter_records(os.path.join(input_path, file_name))]
+
+
+def read_documents_file(input_path):
+    """Files of an outputdata folder, from documents.jsonl or the documents.csv of folders extracted before it"""
+    if has_records(input_path, documents_records_name):
+        return read_documents_jsonl(input_path)
+    return read_documents_csv(input_path)
+
+
 def read_embedded_documents(input_path, csv_name="documents.csv"):
     """
-    Read documents.csv from 'embeddata' folder，and save to EmbeddedFile
+    Read documents.csv and the binary vector store from 'embeddata' folder，and save to EmbeddedFile
+    Args:
+        input_path: input folder
+        csv_name: csv filename，documents.csv by default
+
+    Returns:
+        EmbeddedFile list, vectors are read-only views into the memory-mapped store
+    """
+    csv_path = os.path.join(input_path, csv_name)
+    store = VectorStore(input_path, os.path.splitext(csv_name)[0])
+    rows = {file_id: row for row, file_id in enumerate(store.ids().tolist())}
+    file_paths = store.load("file_path") if "file_path" in store.fields() else None  # not in the embedding profile
+
+    documents = []
+    with open(csv_path, 'r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+
+        for row in reader:
+            file_id = int(row[0])
+            file_path = file_paths[rows[file_id]] if file_paths is not None else None
+            embed_file = EmbeddedFile(file_id=file_id, file_path=file_path)
+            documents.append(embed_file)
+
+    file.close()
+    return documents
+
+
+def read_legacy_embedded_documents(input_path, csv_name="documents.csv"):
+    """
+    Read documents.csv with stringified embeddings (before the binary vector store)，and save to EmbeddedFile
     Args:
         input_path: input folder
         csv_name: csv filename，documents.csv by default
@@ -0,0 +1,136 @@
+import random
+import string
+import time
+
+
+class TagMatcher:
+    """
+    Finds every tag that occurs in a text, same result as testing `tag in text` for every tag (overlapping and
+    nested tags included). Each tag is indexed under one of its gram_length-character substrings, the least shared
+    one, so a text only checks the tags whose anchor is among its own substrings. Adding a tag is one dict append,
+    nothing is rebuilt when the vocabulary grows.
+    Collecting the substrings of a text costs about scan_cost `tag in text` checks per character, texts longer than
+    the vocabulary allows are searched with `tag in text` for every tag instead
+    """
+
+    def __init__(self, patterns=(), gram_length=3, scan_cost=0.75):
+        """
+        Args:
+            patterns: initial tags
+            gram_length: characters of the anchors, tags shorter than that are always tested with `tag in text`
+            scan_cost: cost of one text character for the index, in `tag in text` checks
+        """
+        self.anchors = {}  # substring -> tags indexed under it
+        self.short = []  # tags shorter than gram_length
+        self.patterns = set()
+        self.match_empty = False
+        self.gram_length = gram_length
+        self.scan_cost = scan_cost
+        self.add_patterns(patterns)
+
+    def __len__(self):
+        return len(self.patterns) + self.match_empty
+
+    def add(self, pattern):
+        """Add one pattern, found by the next find()"""
+        if pattern in self.patterns:
+            return
+        if pattern == "":  # found in every text
+            self.match_empty = True
+            return
+        self.patterns.add(pattern)
+        q = self.gram_length
+        if len(pattern) < q:
+            self.short.append(pattern)
+            return
+        grams = [pattern[i:i + q] for i in range(len(pattern) - q + 1)]
+        shared = [len(self.anchors[gram]) if gram in self.anchors else 0 for gram in grams]
+        self.anchors.setdefault(grams[shared.index(min(shared))], []).append(pattern)
+
+    def add_patterns(self, patterns):
+        for pattern in patterns:
+            self.add(pattern)
+
+    def find(self, text):
+        """
+        Find tags in text
+        Args:
+            text: string to scan
+
+        Returns:
+            set of tags that occur in text
+        """
+        if len(self.patterns) <= self.scan_cost * len(text):
+            found = naive_find(self.patterns, text)
+        else:
+            anchors = self.anchors
+            grams = set(map("".join, zip(*(text[i:] for i in range(self.gram_length)))))  # every substring, once
+            found = {tag for gram in grams if gram in anchors for tag in anchors[gram] if tag in text}
+            found.update(naive_find(self.short, text))
+        if self.match_empty:
+            found.add("")
+        return found
+
+
+def naive_find(tags, text):
+    """Tag loop used by add_text_content_tags before TagMatcher, kept as benchmark baseline"""
+    return {tag for tag in tags if tag in text}
+
+
+def check_parity(rounds=200, seed=0):
+    """Compare TagMatcher.find with naive_find on random vocabularies grown between searches, both search modes"""
+    rng = random.Random(seed)
+    for _ in range(rounds):
+        alphabet = "ab" if rng.random() < 0.5 else "abc "
+        matcher = TagMatcher(gram_length=rng.choice([1, 2, 3, 4]), scan_cost=rng.choice([0, 0.75, 100]))
+        vocabulary = set()
+        for _ in range(rng.randint(1, 10)):
+            new_tags = ["".join(rng.choices(alphabet, k=rng.randint(0, 6))) for _ in range(rng.randint(0, 20))]
+            matcher.add_patterns(new_tags)
+            vocabulary.update(new_tags)
+            for _ in range(rng.randint(1, 5)):
+                text = "".join(rng.choices(alphabet, k=rng.randint(0, 40)))
+                assert matcher.find(text) == naive_find(vocabulary, text), (sorted(vocabulary), text)
+
+
+if __name__ == "__main__":
+    check_parity()
+    print("TagMatcher.find matches naive_find on random vocabularies")
+
+    # Benchmark: vocabulary of table cells growing file by file, each file's paragraphs tagged against it
+    rng = random.Random(0)
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(3000)]
+
+    for vocabulary_size in (100, 1000, 10000):
+        tags = list({" ".join(rng.sample(words, rng.randint(1, 3))) for _ in range(vocabulary_size)})
+        files = [(tags[i::50], [" ".join(rng.choices(words, k=60)) for _ in range(10)]) for i in range(50)]
+
+        start = time.perf_counter()
+        vocabulary, expected = [], []
+        for file_tags, texts in files:
+            vocabulary += file_tags
+            expected += [naive_find(vocabulary, text) for text in texts]
+        naive_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        matcher, found = TagMatcher(), []
+        for file_tags, texts in files:
+            matcher.add_patterns(file_tags)
+            found += [matcher.find(text) for text in texts]
+        matcher_time = time.perf_counter() - start
+
+        assert found == expected
+        print(f"{len(tags)} tags over {len(files)} files, {len(expected)} paragraphs: loop {naive_time:.3f}s, "
+              f"matcher {matcher_time:.3f}s (adds included), {naive_time / matcher_time:.1f}x")
+
+        # Whole vocabulary known up front (TagIndex over a loaded knowledge base)
+        texts = [text for _, file_texts in files for text in file_texts]
+        start = time.perf_counter()
+        expected = [naive_find(tags, text) for text in texts]
+        naive_time = time.perf_counter() - start
+        start = time.perf_counter()
+        found = [matcher.find(text) for text in texts]
+        matcher_time = time.perf_counter() - start
+        assert found == expected
+        print(f"{len(tags)} tags, {len(texts)} paragraphs: loop {naive_time:.3f}s, matcher {matcher_time:.3f}s, "
+              f"{naive_time / matcher_time:.1f}x")
@@ -4,6 +4,30 @@ import numpy as np
 import os
 import csv
 import ast
+import itertools
+
+from src.storages.vector_store import VectorStore
+from src.loaders.records import objects_records_name, iter_records, has_records
+
+embedded_object_fields = ["file_name", "above", "below", "title", "search_index"]
+
+# Object ids are scoped by file: (file_id << object_id_bits) + position of the object inside the file,
+# so ids stay stable when other files of the knowledge base change
+object_id_bits = 20
+
+
+def file_object_ids(file_id):
+    """Object id generator for one file"""
+    return itertools.count(file_id << object_id_bits)
+
+
+def file_id_range(file_id):
+    """[start, end) of the object ids of one file"""
+    return file_id << object_id_bits, (file_id + 1) << object_id_bits
+
+
+def object_file_id(object_id):
+    return object_id >> object_id_bits
 
 
 def arr2str(array: np.ndarray) -> str:
@@ -11,6 +35,8 @@ def arr2str(array: np.ndarray) -> str:
 
 
 class Object:
+    __slots__ = ("object_id", "file_id", "file_name", "date", "position", "above", "below", "title", "content",
+                 "tags")
     _id = 0
 
     def __init__(self, object_id=None, file_id=0, file_name="", date=None,
@@ -79,8 +105,32 @@ class Object:
         return [self.object_id, self.file_id, self.file_name, self.position,
                 self.above, self.below, self.title, self.date, self.content, self.tags]
 
+    def to_record(self):
+        """for objects.jsonl, tables are [column, row keys, cell values] lists so no repr has to be parsed back"""
+        record = {"object_id": self.object_id, "file_id": self.file_id, "file_name": self.file_name,
+                  "position": self.position, "above": self.above, "below": self.below, "title": self.title,
+                  "date": sorted(self.date), "tags": sorted(self.tags)}
+        if type(self.content) is dict:
+            record["table"] = [[column, list(rows), list(rows.values())] for column, rows in self.content.items()]
+        else:
+            record["text"] = self.content
+        return record
+
+
+def object_from_record(record):
+    """Object of an objects.jsonl record"""
+    if "table" in record:
+        content = {column: dict(zip(keys, values)) for column, keys, values in record["table"]}
+    else:
+        content = record["text"]
+    return Object(object_id=record["object_id"], file_id=record["file_id"], file_name=record["file_name"],
+                  position=record["position"], above=record["above"], below=record["below"], title=record["title"],
+                  date=set(record["date"]), content=content, tags=set(record["tags"]))
+
 
 class EmbeddedObject:
+    __slots__ = ("object_id", "file_id", "file_name", "date", "position", "above", "below", "title", "content",
+                 "tags", "search_index")
     _id = 0
 
     def __init__(self, object_id=None, file_id=0, file_name=None, date=None,
@@ -109,14 +159,13 @@ class EmbeddedObject:
         self.search_index = search_index
 
     def to_list(self):
-        if type(self.content) is dict:
-            content = self.content
-        else:
-            content = arr2str(self.content)
+        """for csv conversion, vectors are stored separately by vectors()"""
+        content = self.content if type(self.content) is dict else ""
+        return [self.object_id, self.file_id, self.position, self.date, content, self.tags]
 
-        return [self.object_id, self.file_id, arr2str(self.file_name), self.position,
-                arr2str(self.above), arr2str(self.below),
-                arr2str(self.title), self.date, content, self.tags, arr2str(self.search_index)]
+    def vectors(self):
+        """Embedding fields for VectorStore, text content shares the search_index vector"""
+        return {field: getattr(self, field) for field in embedded_object_fields}
 
 
 def read_objects_csv(input_path, file_name="objects.csv"):
@@ -150,9 +199,66 @@ def read_objects_csv(input_path, file_name="objects.csv"):
     return objects
 
 
+def read_objects_jsonl(input_path, file_name=objects_records_name):
+    """
+    Read objects.jsonl in target folder
+    Args:
+        input_path: input folder
+        file_name: records filename, objects.jsonl by default
+
+    Returns:
+        Object list
+    """
+    return [object_from_record(record) for record in iter_records(os.path.join(input_path, file_name))]
+
+
+def read_objects_file(input_path):
+    """Objects of an outputdata folder, from objects.jsonl or the objects.csv of folders extracted before it"""
+    if has_records(input_path, objects_records_name):
+        return read_objects_jsonl(input_path)
+    return read_objects_csv(input_path)
+
+
 def read_embedded_objects(input_path, csv_name="objects.csv"):
     """
-    Read objects.csv from 'embeddate' folder，and save to EmbeddedObject
+    Read objects.csv and the binary vector store from 'embeddata' folder，and save to EmbeddedObject
+    Args:
+        input_path: input folder
+        csv_name: csv filename，objects.csv by default
+
+    Returns:
+        EmbeddedObject list, vectors are read-only views into the memory-mapped store
+    """
+    csv_path = os.path.join(input_path, csv_name)
+    store = VectorStore(input_path, os.path.splitext(csv_name)[0])
+    rows = {object_id: row for row, object_id in enumerate(store.ids().tolist())}
+    vectors = {field: store.load(field) for field in store.fields()}
+
+    objects = []
+    with open(csv_path, 'r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+
+        for row in reader:
+            object_id = int(row[0])
+            embedding = {field: matrix[rows[object_id]] for field, matrix in vectors.items()}
+            if row[4].startswith('{') and row[4].endswith('}'):
+                content = ast.literal_eval(row[4])  # dict
+            else:
+                content = embedding.get("search_index")  # Embedding
+
+            embed_object = EmbeddedObject(object_id=object_id, file_id=int(row[1]), position=int(row[2]),
+                                          date=ast.literal_eval(row[3]), content=content,
+                                          tags=ast.literal_eval(row[5]), **embedding)
+            objects.append(embed_object)
+
+    file.close()
+    return objects
+
+
+def read_legacy_embedded_objects(input_path, csv_name="objects.csv"):
+    """
+    Read objects.csv with stringified embeddings (before the binary vector store)，and save to EmbeddedObject
     Args:
         input_path: input folder
         csv_name: csv filename，objects.csv by default
@@ -0,0 +1,39 @@
+import json
+import os
+
+# Typed JSON lines files of an extracted knowledge base, one record per line.
+# The csv files next to them are an export for inspection, they are not read back when these exist
+objects_records_name = "objects.jsonl"
+documents_records_name = "documents.jsonl"
+tags_records_name = "tags.jsonl"
+
+
+def dump_record(record):
+    """One JSON line, newline included"""
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def write_records(path, records, mode='w'):
+    """
+    Write records as JSON lines
+    Args:
+        path: .jsonl path
+        records: iterable of JSON-serializable dicts
+        mode: 'w' to rewrite the file, 'a' to append
+    """
+    with open(path, mode=mode, encoding='utf-8') as file:
+        file.writelines(dump_record(record) for record in records)
+    file.close()
+
+
+def iter_records(path):
+    """Records of a JSON lines file, one dict per line"""
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+    file.close()
+
+
+def has_records(input_path, file_name):
+    return os.path.exists(os.path.join(input_path, file_name))
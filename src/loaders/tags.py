@@ -5,12 +5,17 @@ import csv
 import ast
 import json
 
+from src.storages.vector_store import VectorStore
+from src.loaders.matcher import TagMatcher
+from src.loaders.records import tags_records_name, iter_records, has_records
+
 default_local_path = os.path.join(os.path.dirname(__file__), "local_tags.json")
 
 
 class Tags:
     def __init__(self):
         self.tags_dict = {}
+        self.matcher = TagMatcher()  # every tag name, for find_in
 
     def add_tag(self, tag_name, related_object_id=None):
         if related_object_id is not None:  # given id
@@ -20,18 +25,25 @@ class Tags:
                 new_set = set()
                 new_set.add(related_object_id)
                 self.tags_dict[tag_name] = new_set
+                self.matcher.add(tag_name)
         else:  # no id
             if tag_name in self.tags_dict:
                 return
             else:
                 self.tags_dict[tag_name] = set()
+                self.matcher.add(tag_name)
 
     def add_tags(self, tag_name, related_object_ids):
         self.tags_dict[tag_name] = related_object_ids
+        self.matcher.add(tag_name)
 
     def is_in(self, tag_name):
         return tag_name in self.tags_dict
 
+    def find_in(self, text):
+        """All tag names that occur in text, in one pass over the text"""
+        return self.matcher.find(text)
+
     def to_csv(self, csv_path):
         with open(csv_path, mode='a', newline='', encoding='utf-8') as file:
             writer = csv.writer(file, quoting=csv.QUOTE_ALL)
@@ -45,6 +57,15 @@ class Tags:
                     id += 1
         file.close()
 
+    def to_records(self):
+        """for tags.jsonl, same rows and ids as to_csv"""
+        tag_id = 0
+        for tag in self.tags_dict:
+            related_object_ids = self.tags_dict[tag]
+            if related_object_ids != set():
+                yield {"tag_id": tag_id, "tag_name": tag, "related_object_ids": sorted(related_object_ids)}
+                tag_id += 1
+
 
 class EmbeddedTag:
     _id = 0
@@ -59,13 +80,47 @@ class EmbeddedTag:
         self.related_object_ids = related_object_ids
 
     def to_list(self):
-        return [self.tag_id, np.array2string(self.tag_name, separator=',', max_line_width=100000),
-                self.related_object_ids]
+        """for csv conversion, vectors are stored separately by vectors()"""
+        return [self.tag_id, self.related_object_ids]
+
+    def vectors(self):
+        return {"tag_name": self.tag_name}
 
 
 def read_embedded_tags(input_path, csv_name="tags.csv"):
     """
-    Read tags.csv from 'embeddata'，and store to EmbeddedTag
+    Read tags.csv and the binary vector store from 'embeddata'，and store to EmbeddedTag
+    Args:
+        csv_name: csv name，tags.csv by default
+        input_path: input folder
+
+    Returns:
+        EmbeddedTag list, vectors are read-only views into the memory-mapped store
+    """
+    csv_path = os.path.join(input_path, csv_name)
+    store = VectorStore(input_path, os.path.splitext(csv_name)[0])
+    rows = {tag_id: row for row, tag_id in enumerate(store.ids().tolist())}
+    tag_names = store.load("tag_name") if "tag_name" in store.fields() else None  # not in the embedding profile
+
+    tags = []
+    with open(csv_path, 'r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        header = next(reader)  # skip headers
+
+        for row in reader:
+            tag_id = int(row[0])
+            tag_name = tag_names[rows[tag_id]] if tag_names is not None else None
+            _tag = EmbeddedTag(tag_id=tag_id, tag_name=tag_name,
+                               related_object_ids=ast.literal_eval(row[1]))
+            tags.append(_tag)
+
+    file.close()
+    return tags
+
+
+def read_legacy_embedded_tags(input_path, csv_name="tags.csv"):
+    """
+    Read tags.csv with stringified embeddings (before the binary vector store)，and store to EmbeddedTag
     Args:
         csv_name: csv name，tags.csv by default
         input_path: input folder
@@ -157,6 +212,29 @@ def read_tags_csv(input_path, file_name="tags.csv"):
     return tags
 
 
+def read_tags_jsonl(input_path, file_name=tags_records_name):
+    """
+    Read tags.jsonl in target folder
+    Args:
+        input_path: folder to read
+        file_name: records filename
+
+    Returns:
+        Tags
+    """
+    tags = Tags()
+    for record in iter_records(os.path.join(input_path, file_name)):
+        tags.add_tags(tag_name=record["tag_name"], related_object_ids=set(record["related_object_ids"]))
+    return tags
+
+
+def read_tags_file(input_path):
+    """Tags of an outputdata folder, from tags.jsonl or the tags.csv of folders extracted before it"""
+    if has_records(input_path, tags_records_name):
+        return read_tags_jsonl(input_path)
+    return read_tags_csv(input_path)
+
+
 if __name__ == "__main__":
     tags = load_tags()
     for i in tags.tags_dict:
@@ -0,0 +1,163 @@
+import os
+import re
+from array import array
+from collections import Counter
+
+import numpy as np
+
+bm25_file_name = "bm25.npz"
+
+# CJK characters are single tokens, other scripts split on non-word characters
+token_pattern = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]|[^\W_\u3400-\u9fff\uf900-\ufaff]+")
+
+
+def tokenize(text):
+    """Lowercase word tokens of a text"""
+    return token_pattern.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 over object texts.
+    Postings are kept in flat numpy arrays: term i owns rows offsets[i]:offsets[i + 1] of
+    posting_rows (document row, int32) and posting_tfs (term frequency, int32).
+    Document row r is object doc_ids[r] with doc_lens[r] tokens
+    """
+
+    def __init__(self, terms=(), offsets=None, posting_rows=None, posting_tfs=None, doc_ids=None, doc_lens=None,
+                 k1=1.5, b=0.75):
+        self.terms = list(terms)
+        self.term_ids = {term: i for i, term in enumerate(self.terms)}
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else np.asarray(offsets, dtype=np.int64)
+        self.posting_rows = np.empty(0, dtype=np.int32) if posting_rows is None else np.asarray(posting_rows, np.int32)
+        self.posting_tfs = np.empty(0, dtype=np.int32) if posting_tfs is None else np.asarray(posting_tfs, np.int32)
+        self.doc_ids = np.empty(0, dtype=np.int64) if doc_ids is None else np.asarray(doc_ids, dtype=np.int64)
+        self.doc_lens = np.empty(0, dtype=np.int32) if doc_lens is None else np.asarray(doc_lens, dtype=np.int32)
+        self.k1 = k1
+        self.b = b
+
+        n = len(self.doc_ids)
+        df = np.diff(self.offsets)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = self.doc_lens.mean() if n else 1.0
+        self.norms = (k1 * (1 - b + b * self.doc_lens / max(avgdl, 1e-9))).astype(np.float32)  # per document
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @classmethod
+    def from_postings(cls, terms, term_col, row_col, tf_col, doc_ids, doc_lens):
+        """Sort (term, row, tf) triples by term into the flat posting arrays"""
+        term_col = np.asarray(term_col, dtype=np.int64)
+        order = np.argsort(term_col, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_col, minlength=len(terms)), out=offsets[1:])
+        return cls(terms, offsets, np.asarray(row_col, dtype=np.int32)[order],
+                   np.asarray(tf_col, dtype=np.int32)[order], doc_ids, doc_lens)
+
+    @classmethod
+    def build(cls, ids, texts):
+        """
+        Index texts
+        Args:
+            ids: object id of each text
+            texts: iterable of texts, e.g. Object.to_str()
+
+        Returns:
+            BM25Index
+        """
+        vocabulary = {}
+        term_col, row_col, tf_col, doc_lens = array('q'), array('i'), array('i'), array('i')
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lens.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_col.append(vocabulary.setdefault(term, len(vocabulary)))
+                row_col.append(row)
+                tf_col.append(tf)
+        return cls.from_postings(list(vocabulary), term_col, row_col, tf_col, list(ids), doc_lens)
+
+    def triples(self):
+        """(term, row, tf) columns of all postings"""
+        term_col = np.repeat(np.arange(len(self.terms), dtype=np.int64), np.diff(self.offsets))
+        return term_col, self.posting_rows, self.posting_tfs
+
+    def merge(self, other, offset=0):
+        """Add the documents of another BM25Index, its object ids shifted by offset"""
+        vocabulary = dict(self.term_ids)
+        for term in other.terms:
+            vocabulary.setdefault(term, len(vocabulary))
+        remap = np.array([vocabulary[term] for term in other.terms], dtype=np.int64)
+
+        term_col, row_col, tf_col = self.triples()
+        other_terms, other_rows, other_tfs = other.triples()
+        merged = BM25Index.from_postings(
+            list(vocabulary),
+            np.concatenate([term_col, remap[other_terms]]),
+            np.concatenate([row_col, other_rows + len(self.doc_ids)]),
+            np.concatenate([tf_col, other_tfs]),
+            np.concatenate([self.doc_ids, other.doc_ids + offset]),
+            np.concatenate([self.doc_lens, other.doc_lens]))
+        self.__init__(merged.terms, merged.offsets, merged.posting_rows, merged.posting_tfs,
+                      merged.doc_ids, merged.doc_lens, self.k1, self.b)
+
+    def search(self, query, k=3):
+        """
+        Rank documents for a query
+        Args:
+            query: query string
+            k: results
+
+        Returns:
+            [(object id, score)], best first, only documents sharing a token with the query
+        """
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for term, qtf in Counter(tokenize(query)).items():
+            i = self.term_ids.get(term)
+            if i is None:
+                continue
+            rows = self.posting_rows[self.offsets[i]:self.offsets[i + 1]]
+            tfs = self.posting_tfs[self.offsets[i]:self.offsets[i + 1]]
+            scores[rows] += qtf * self.idf[i] * tfs * (self.k1 + 1) / (tfs + self.norms[rows])
+
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(int(self.doc_ids[row]), float(scores[row])) for row in hits]
+
+    def search_many(self, queries, k=3):
+        return [self.search(query, k) for query in queries]
+
+    def save(self, embedded_file_path):
+        np.savez(os.path.join(embedded_file_path, bm25_file_name), terms=np.array(self.terms, dtype=str),
+                 offsets=self.offsets, posting_rows=self.posting_rows, posting_tfs=self.posting_tfs,
+                 doc_ids=self.doc_ids, doc_lens=self.doc_lens)
+
+    @classmethod
+    def load(cls, embedded_file_path):
+        with np.load(os.path.join(embedded_file_path, bm25_file_name)) as data:
+            return cls(data["terms"].tolist(), data["offsets"], data["posting_rows"], data["posting_tfs"],
+                       data["doc_ids"], data["doc_lens"])
+
+
+def has_bm25_index(embedded_file_path):
+    return os.path.exists(os.path.join(embedded_file_path, bm25_file_name))
+
+
+def reciprocal_rank_fusion(rankings, k=3, rrf_k=60):
+    """
+    Fuse several rankings of the same query
+    Args:
+        rankings: list of [(id, score)] lists, best first
+        k: results
+        rrf_k: rank constant, larger values flatten the contribution of the top ranks
+
+    Returns:
+        [(id, fused score)], best first
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, (idx, _) in enumerate(ranking):
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
@@ -1,42 +1,494 @@
+import os
+import re
+import json
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import faiss  # faiss-cpu
-from src.loaders.object import read_embedded_objects, read_objects_csv
+from src.loaders.object import read_objects_file, file_id_range, object_file_id
 from src.embeddings.baai import BAAIEmbeddings
+from src.embeddings.cache import normalize_text
+from src.storages.vector_store import VectorStore
+from src.storages.tag_index import TagIndex, has_tag_index, build_tag_index
+from src.storages.bm25 import BM25Index, has_bm25_index, reciprocal_rank_fusion
+from src.storages.object_table import ObjectTable, has_object_table
+from src.utils.log import get_console_logger
+
+logger = get_console_logger('FAISS')
+
+index_file_name = "index.faiss"
+doc_map_file_name = "doc_map.json"  # id -> text of indexes saved before the object table
+
+# Index presets, {nlist}, {m}, {nbits} and {pca} are filled in from the knowledge base size and vector dimension,
+# any faiss factory string works too. Compressed presets trade recall for memory per vector (768-d bge-base):
+# Flat 3072 B, SQfp16 1536 B, SQ8 768 B, PQ 96 B, PCA keeps a quarter of the dimensions, trained per knowledge base.
+# IndexPQ rejects id selectors, tag-restricted searches over "pq" fetch more results and keep the candidates instead
+# (FaissIdx.search_subset). See recall_report.py for recall@k of each against exact search
+index_presets = {
+    "flat": "Flat",
+    "fp16": "SQfp16",
+    "sq8": "SQ8",
+    "pq": "PQ{m}x{nbits}",
+    "pca_flat": "PCA{pca},Flat",
+    "pca_sq8": "PCA{pca},SQ8",
+    "ivf_flat": "IVF{nlist},Flat",
+    "ivf_sq8": "IVF{nlist},SQ8",
+    "ivf_pq": "IVF{nlist},PQ{m}x{nbits}",
+    "hnsw": "HNSW32",
+    "hnsw_sq8": "HNSW32,SQ8",
+}
+
+
+def resolve_index_spec(index_spec, n, dim):
+    """
+    Turn a preset name or faiss factory string into a factory string for n vectors
+    Args:
+        index_spec: key of index_presets, or faiss.index_factory string
+        n: number of vectors to index
+        dim: vector dimension
+
+    Returns:
+        faiss.index_factory string
+    """
+    spec = index_presets.get(index_spec, index_spec)
+    pca = dim // 4
+    nlist = max(1, min(int(4 * math.sqrt(n)), n // 39))  # faiss wants ~39 training points per centroid
+    nbits = max(4, min(8, int(math.log2(max(n // 39, 1)))))  # 2^nbits PQ centroids per sub-quantizer
+    reduced = re.match(r"PCAR?W?(\d+|\{pca\})", spec)  # sub-quantizers split the PCA output
+    if reduced:
+        dim = pca if reduced.group(1) == "{pca}" else int(reduced.group(1))
+    m = next(m for m in (96, 64, 48, 32, 16, 8, 4, 2, 1) if dim % m == 0)  # PQ sub-quantizers
+    return spec.format(nlist=nlist, m=m, nbits=nbits, pca=pca)
 
 
 class FaissIdx:
-    def __init__(self, model, dim=768):
+    def __init__(self, model, dim=768, index_spec="flat", nprobe=None, ef_search=None, train_size=100000,
+                 query_cache_size=1024, search_mode="dense"):
         """
         model: Embedding Model
+        index_spec: key of index_presets (flat/sq8/pq/pca_flat/ivf_flat/ivf_pq/hnsw...) or a faiss factory string,
+                    built on the first bulk add
+        nprobe: IVF lists visited per query
+        ef_search: HNSW search queue size
+        train_size: max vectors sampled to train IVF/PQ
+        query_cache_size: query embeddings kept in the in-process LRU cache
+        search_mode: "dense" for FAISS only, "hybrid" to fuse FAISS and BM25 rankings
         """
-        self.index = faiss.IndexFlatL2(dim)
-        self.doc_map = dict()
+        self.dim = dim
+        self.index_spec = index_spec
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.train_size = train_size
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+        self.selector_rejected = False  # the index type does not take id selectors (IndexPQ)
+        self.objects = ObjectTable()  # documents by object id, rendered to text for search results
         self.model = model
-        self.ctr = 0
+        self.ctr = 0  # next free id for documents added without one
+        self.tag_index = None  # TagIndex of the loaded knowledge bases, restricts queries mentioning tags/dates
+        self.lexical_index = None  # BM25Index over the document texts, for hybrid search
+        self.search_mode = search_mode
+        self._executor = ThreadPoolExecutor(max_workers=4)  # dense side of hybrid searches
+        self.query_cache = OrderedDict()
+        self.query_cache_size = query_cache_size
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+        self._query_cache_lock = threading.Lock()
+
+    def make_index(self, vectors):
+        """
+        Create the index described by index_spec, trained on a sample of vectors if needed.
+        It is wrapped in faiss.IndexIDMap2 so documents are searched and removed by object id
+        """
+        spec = resolve_index_spec(self.index_spec, len(vectors), self.dim)
+        index = faiss.index_factory(self.dim, spec)
+        if not index.is_trained:
+            sample_size = min(len(vectors), self.train_size)
+            sample = np.sort(np.random.default_rng(0).choice(len(vectors), sample_size, replace=False))
+            try:
+                index.train(np.ascontiguousarray(vectors[sample], dtype=np.float32))
+            except RuntimeError as e:
+                logger.warning(f"Cannot train {spec} on {sample_size} vectors, using Flat: {e}")
+                index = faiss.IndexFlatL2(self.dim)
+        logger.info(f"Created {spec} index")
+        return faiss.IndexIDMap2(index)
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """Set nprobe (IVF) / efSearch (HNSW), parameters the index does not have are ignored"""
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+
+        params = faiss.ParameterSpace()
+        for name, value in (("nprobe", self.nprobe), ("efSearch", self.ef_search)):
+            if value is None:
+                continue
+            try:
+                params.set_index_parameter(self.index, name, value)
+            except RuntimeError:
+                pass
+
+    def add_vectors(self, vectors, documents, ids=None, train_vectors=None):
+        """
+        Bulk add embeddings with one index.add_with_ids call
+        Args:
+            vectors: (n, dim) float32 matrix, e.g. memory-mapped from VectorStore
+            documents: Object or plain text of each row
+            ids: object id of each row, next free ids if not given
+            train_vectors: all vectors that will be added, used to create the index when vectors is only
+                           the first chunk of them
+        """
+        if len(vectors) == 0:
+            return
+        if ids is None:
+            ids = np.arange(self.ctr, self.ctr + len(vectors), dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+
+        if self.index.ntotal == 0:
+            self.index = self.make_index(vectors if train_vectors is None else train_vectors)
+            self.set_search_params()
+            self.selector_rejected = False
+
+        self.index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), ids)
+        self.objects.extend(ids.tolist(), documents)
+        self.ctr = max(self.ctr, int(ids.max()) + 1)
+
+    def remove_files(self, file_ids):
+        """
+        Remove the vectors of all objects of some files
+        Args:
+            file_ids: file ids to remove
+
+        Raises:
+            RuntimeError: the index type does not support removal (HNSW), rebuild it instead
+        """
+        file_ids = set(file_ids)
+        for file_id in file_ids:
+            start, end = file_id_range(file_id)
+            self.index.remove_ids(faiss.IDSelectorRange(start, end))
+        self.objects.remove_files(file_ids)
 
     def add_doc(self, document_text):
         """Add document and proceed embedding"""
-        self.index.add(self.model.embed_query(document_text).reshape(1, -1))
-        self.doc_map[self.ctr] = document_text  # store the original document text
-        self.ctr += 1
+        self.add_vectors(np.asarray(self.model.embed_query(document_text)).reshape(1, -1), [document_text])
 
     def add_emb_doc(self, embedding, text):
         """Add embedded documents"""
-        self.index.add(embedding.reshape(1, -1))
-        self.doc_map[self.ctr] = text
-        self.ctr += 1
+        self.add_vectors(embedding.reshape(1, -1), [text])
 
     def add_folder(self, original_file_path, embedded_file_path):
         """Import embeddings from specific knowledge base，search text directly，search tables by 'Date[SEP]Table Name[SEP]Tags'"""
-        ori = read_objects_csv(original_file_path)
-        emb = read_embedded_objects(embedded_file_path)
+        ori = read_objects_file(original_file_path)
+        store = VectorStore(embedded_file_path, "objects")
+        rows = {object_id: row for row, object_id in enumerate(store.ids().tolist())}
+        search_index = store.load("search_index")  # memory-mapped, rows are added without parsing or copying
+
+        order = np.array([rows[obj.object_id] for obj in ori], dtype=np.int64)
+        if not np.array_equal(order, np.arange(len(order))):
+            search_index = search_index[order]
+        self.add_vectors(search_index, ori, [obj.object_id for obj in ori])
+
+    def save(self, embedded_file_path):
+        """Serialize the index and its object table next to the knowledge base's hash.txt"""
+        faiss.write_index(self.index, os.path.join(embedded_file_path, index_file_name))
+        self.objects.save(embedded_file_path)
+        legacy_doc_map = os.path.join(embedded_file_path, doc_map_file_name)
+        if os.path.exists(legacy_doc_map):
+            os.remove(legacy_doc_map)
+        if self.tag_index is not None:
+            self.tag_index.save(embedded_file_path)
+        if self.lexical_index is not None:
+            self.lexical_index.save(embedded_file_path)
+
+    def build_lexical_index(self):
+        """(Re)build the BM25 index from the texts of all documents"""
+        self.lexical_index = BM25Index.build(self.objects.ids, (text for _, text in self.objects.texts()))
+
+    def load_folder(self, embedded_file_path, mmap=False):
+        """
+        Load an index saved by save(), instead of re-reading and re-inserting every embedding.
+        A missing BM25 index (knowledge base saved before hybrid search) is built and saved here,
+        a doc_map.json of a knowledge base saved before the object table is read as plain documents
+        Args:
+            embedded_file_path: embeddata folder of the knowledge base
+            mmap: open with faiss.IO_FLAG_MMAP, vectors are paged in lazily from disk
+        """
+        flags = faiss.IO_FLAG_MMAP if mmap else 0
+        index = faiss.read_index(os.path.join(embedded_file_path, index_file_name), flags)
+        if has_object_table(embedded_file_path):
+            objects = ObjectTable.load(embedded_file_path)
+        else:
+            with open(os.path.join(embedded_file_path, doc_map_file_name), 'r', encoding='utf-8') as file:
+                doc_map = json.load(file)
+            file.close()
+            objects = ObjectTable.from_texts({int(idx): text for idx, text in doc_map.items()})
+
+        tag_index = TagIndex.load(embedded_file_path) if has_tag_index(embedded_file_path) else None
+        if has_bm25_index(embedded_file_path):
+            lexical_index = BM25Index.load(embedded_file_path)
+        else:
+            lexical_index = BM25Index.build(objects.ids, (text for _, text in objects.texts()))
+            lexical_index.save(embedded_file_path)
+
+        offset = 0
+        if self.index.ntotal == 0:
+            self.index = index
+            self.set_search_params()
+            self.selector_rejected = False
+        else:  # another knowledge base is loaded, shift ids past the ones in use
+            if has_trained_codes(index) or has_trained_codes(self.index):
+                raise ValueError("Indexes trained per knowledge base (IVF/SQ8/PQ/PCA) cannot be merged, "
+                                 "load each knowledge base into its own FaissIdx (IndexRegistry)")
+            offset = self.ctr
+            id_map = faiss.vector_to_array(index.id_map)
+            faiss.copy_array_to_vector(id_map + offset, index.id_map)
+            index.construct_rev_map()
+            self.index.merge_from(index)
+
+        if tag_index is not None:
+            if self.tag_index is None:
+                self.tag_index = TagIndex()
+            self.tag_index.merge(tag_index, offset)
+        if self.lexical_index is None:
+            self.lexical_index = BM25Index()
+        self.lexical_index.merge(lexical_index, offset)
+
+        if len(self.objects) == 0 and offset == 0:
+            self.objects = objects
+        else:
+            self.objects.merge(objects, offset)
+        if len(objects):
+            self.ctr = max(self.ctr, objects.max_id() + offset + 1)
+
+
+    def embed_queries(self, queries):
+        """
+        Embed queries through the LRU cache, all misses are encoded in one batch
+        Args:
+            queries: list of query strings
+
+        Returns:
+            (len(queries), dim) float32 matrix
+        """
+        keys = [normalize_text(query) for query in queries]
+        with self._query_cache_lock:
+            found = {}
+            for key in keys:
+                if key in self.query_cache:
+                    self.query_cache.move_to_end(key)
+                    found[key] = self.query_cache[key]
+            misses = [key for key in dict.fromkeys(keys) if key not in found]
+            self.query_cache_hits += len(keys) - len(misses)
+            self.query_cache_misses += len(misses)
+
+        if misses:
+            embeddings = np.asarray(self.model.embed_documents(misses), dtype=np.float32).reshape(len(misses), -1)
+            with self._query_cache_lock:
+                for key, embedding in zip(misses, embeddings):
+                    found[key] = embedding
+                    self.query_cache[key] = embedding
+                    self.query_cache.move_to_end(key)
+                while len(self.query_cache) > self.query_cache_size:
+                    self.query_cache.popitem(last=False)
+
+        return np.ascontiguousarray(np.stack([found[key] for key in keys]), dtype=np.float32)
+
+    def search_params(self, selector):
+        """faiss.SearchParameters of the wrapped index type restricted to selector, keeping nprobe/efSearch"""
+        index = faiss.downcast_index(self.index.index)
+        if isinstance(index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+        if isinstance(index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+        return faiss.SearchParameters(sel=selector)
+
+    def search_subset(self, embedding, k, ids):
+        """
+        Search only among some object ids
+        Args:
+            embedding: (1, dim) query embedding
+            k: results
+            ids: sorted object ids to search
+
+        Returns:
+            (D, I) like index.search, with fewer than k results if the subset is smaller
+        """
+        if not self.selector_rejected:
+            try:
+                return self.index.search(embedding, k, params=self.search_params(faiss.IDSelectorBatch(ids)))
+            except RuntimeError as e:  # IndexPQ
+                logger.info(f"Index does not support id selectors, filtering its results instead: {e}")
+                self.selector_rejected = True
+
+        # Over-fetch in proportion to the share of candidates, fetch more until k of them are found
+        ids = np.asarray(ids, dtype=np.int64)
+        ntotal = self.index.ntotal
+        fetch = min(ntotal, 4 * k * ntotal // max(len(ids), 1) + k)
+        while True:
+            D, I = self.index.search(embedding, fetch)
+            keep = np.isin(I[0], ids)
+            if keep.sum() >= k or fetch >= ntotal:
+                return D[:, keep][:, :k], I[:, keep][:, :k]
+            fetch = min(ntotal, fetch * 4)
+
+    def search_ids(self, queries, k=3, use_tags=True):
+        """
+        Dense search of several queries with one encoder batch and one index.search on the stacked matrix.
+        Queries mentioning known tags or dates are searched only among the objects having them (see
+        TagIndex.candidates), topped up from the whole index if that gives fewer than k results
+        Args:
+            queries: list of query strings
+            k: results per query
+            use_tags: restrict queries by the tag index
+
+        Returns:
+            [(object id, distance)] per query, best first
+        """
+        if not queries:
+            return []
+        embeddings = self.embed_queries(queries)
+
+        results = [None] * len(queries)
+        for i, query in enumerate(queries):
+            if not use_tags or self.tag_index is None:
+                continue
+            ids, terms = self.tag_index.candidates(query)
+            if ids is None or len(ids) >= self.index.ntotal:
+                continue
+            found = self.search_subset(embeddings[i:i + 1], k, ids)
+            logger.info(f"Searching {len(ids)} of {self.index.ntotal} objects for {terms}")
+            results[i] = list(zip(found[1][0].tolist(), found[0][0].tolist()))
+
+        results = [[(idx, score) for idx, score in hits if idx in self.objects] if hits else []
+                   for hits in results]
+        full = [i for i, hits in enumerate(results) if len(hits) < k]  # unrestricted or not enough hits
+        if full:
+            D, I = self.index.search(embeddings[full], k)
+            for i, ids, scores in zip(full, I, D):
+                seen = {idx for idx, _ in results[i]}
+                results[i] += [(idx, score) for idx, score in zip(ids.tolist(), scores.tolist())
+                               if idx in self.objects and idx not in seen]
+        return [hits[:k] for hits in results]
+
+    def hybrid_search_ids(self, queries, k=3, use_tags=True, candidates=None):
+        """
+        Fuse the dense and BM25 rankings with reciprocal rank fusion, both retrievers run concurrently
+        Args:
+            queries: list of query strings
+            k: results per query
+            use_tags: restrict the dense side by the tag index
+            candidates: results taken from each retriever before fusion, max(4 * k, 20) by default
+
+        Returns:
+            [(object id, fused score)] per query, best first
+        """
+        if candidates is None:
+            candidates = max(4 * k, 20)
+        dense = self._executor.submit(self.search_ids, queries, candidates, use_tags)
+        lexical = self.lexical_index.search_many(queries, candidates)
+        return [reciprocal_rank_fusion([dense_hits, lexical_hits], k)
+                for dense_hits, lexical_hits in zip(dense.result(), lexical)]
+
+    def search_many(self, queries, k=3, use_tags=True, mode=None):
+        """
+        Search several queries
+        Args:
+            queries: list of query strings
+            k: results per query
+            use_tags: restrict queries by the tag index
+            mode: "dense" or "hybrid", search_mode by default; hybrid needs the BM25 index
+
+        Returns:
+            One search_doc-style result list per query
+        """
+        results = self.search_many_ids(queries, k, use_tags, mode)
+        return [[{self.objects.render(idx): score} for idx, score in hits] for hits in results]  # top-k only
+
+    def search_many_ids(self, queries, k=3, use_tags=True, mode=None):
+        """search_many as (object id, score) lists, nothing rendered"""
+        mode = self.search_mode if mode is None else mode
+        if mode == "hybrid" and self.lexical_index is not None:
+            return self.hybrid_search_ids(queries, k, use_tags)
+        return self.search_ids(queries, k, use_tags)
+
+    def search_doc(self, query, k=3, mode=None):
+        return self.search_many([query], k, mode=mode)[0]
+
+    def search_hits(self, query, k=3, mode=None):
+        """(object ids in rank order, search_doc results) of one query"""
+        hits = self.search_many_ids([query], k, mode=mode)[0]
+        return [int(idx) for idx, _ in hits], [{self.objects.render(idx): score} for idx, score in hits]
+
+
+def has_trained_codes(index):
+    """Whether vectors are encoded with centroids/codebooks/PCA trained on one knowledge base's vectors"""
+    index = faiss.downcast_index(index.index if isinstance(index, faiss.IndexIDMap) else index)
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return index.sq.qtype != faiss.ScalarQuantizer.QT_fp16
+    return not isinstance(index, (faiss.IndexFlat, faiss.IndexHNSW))
+
+
+def index_needs_training(index_spec, dim=768):
+    """Whether the index type has to be trained (IVF/PQ) before vectors can be added"""
+    return not faiss.index_factory(dim, resolve_index_spec(index_spec, 100000, dim)).is_trained
+
+
+def has_saved_index(embedded_file_path):
+    return (os.path.exists(os.path.join(embedded_file_path, index_file_name))
+            and (has_object_table(embedded_file_path)
+                 or os.path.exists(os.path.join(embedded_file_path, doc_map_file_name))))
+
+
+def index_folder(model, original_file_path, embedded_file_path, index_spec="flat"):
+    """Build the index of a knowledge base from its embeddings and save it to embeddata"""
+    faiss_idx = FaissIdx(model, index_spec=index_spec)
+    faiss_idx.add_folder(original_file_path, embedded_file_path)
+    faiss_idx.tag_index = build_tag_index(original_file_path)
+    faiss_idx.build_lexical_index()
+    faiss_idx.save(embedded_file_path)
+    return faiss_idx
+
 
-        for i in range(len(ori)):
-            self.add_emb_doc(emb[i].search_index, ori[i].to_str())
+def update_index_folder(model, original_file_path, embedded_file_path, update_file_ids, drop_file_ids=(),
+                        index_spec="flat"):
+    """
+    Update the saved index of a knowledge base in place: vectors of changed/deleted files are removed,
+    vectors of added/changed files are added. Falls back to index_folder if there is no saved index
+    or the index type cannot remove vectors
+    Args:
+        model: embedding model
+        original_file_path: outputdata folder
+        embedded_file_path: embeddata folder
+        update_file_ids: file ids of added/changed files
+        drop_file_ids: file ids of deleted files
+        index_spec: index type used when rebuilding
+    """
+    if not has_saved_index(embedded_file_path):
+        return index_folder(model, original_file_path, embedded_file_path, index_spec)
 
+    faiss_idx = FaissIdx(model, index_spec=index_spec)
+    faiss_idx.load_folder(embedded_file_path)
+    update_file_ids = set(update_file_ids)
+    try:
+        faiss_idx.remove_files(update_file_ids | set(drop_file_ids))
+    except RuntimeError as e:
+        logger.warning(f"Index cannot remove vectors, rebuilding: {e}")
+        return index_folder(model, original_file_path, embedded_file_path, index_spec)
 
-    def search_doc(self, query, k=3):
-        D, I = self.index.search(self.model.embed_query(query).reshape(1, -1), k)
-        return [{self.doc_map[idx]: score} for idx, score in zip(I[0], D[0]) if idx in self.doc_map]
+    ori = [obj for obj in read_objects_file(original_file_path) if object_file_id(obj.object_id) in update_file_ids]
+    store = VectorStore(embedded_file_path, "objects")
+    rows = {object_id: row for row, object_id in enumerate(store.ids().tolist())}
+    search_index = store.load("search_index")
+    if ori:
+        faiss_idx.add_vectors(search_index[[rows[obj.object_id] for obj in ori]],
+                              ori, [obj.object_id for obj in ori])
+    faiss_idx.tag_index = build_tag_index(original_file_path)  # tags.csv is already updated
+    faiss_idx.build_lexical_index()
+    faiss_idx.save(embedded_file_path)
+    return faiss_idx
 
 
 if __name__ == '__main__':
@@ -0,0 +1,265 @@
+import os
+import sys
+from array import array
+
+import numpy as np
+
+from src.loaders.object import object_id_bits, read_objects_file
+
+object_table_file_name = "objects_table.npz"
+
+# Row kinds, plain documents are rendered as stored
+raw_kind, text_kind, table_kind = 0, 1, 2
+
+
+class StringColumn:
+    """Strings stored back to back as UTF-8, string i is data[offsets[i]:offsets[i + 1]]"""
+
+    def __init__(self, data=b"", offsets=None):
+        self.data = bytearray(data)
+        self.offsets = array('q', [0]) if offsets is None else array('q', offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def append(self, value):
+        self.data += value.encode('utf-8')
+        self.offsets.append(len(self.data))
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    def nbytes(self):
+        return len(self.data) + self.offsets.itemsize * len(self.offsets)
+
+
+class Vocabulary:
+    """Interned strings, each stored once and referenced by int id"""
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.ids = {value: i for i, value in enumerate(self.values)}
+
+    def intern(self, value):
+        i = self.ids.get(value)
+        if i is None:
+            i = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def nbytes(self):
+        return sum(sys.getsizeof(value) for value in self.values)
+
+
+class ObjectTable:
+    """
+    Columnar store of the documents of a FaissIdx, replaces an id -> to_str() dict.
+    Every field is one compact column (ints in typed arrays, strings as UTF-8 bytes, file names, dates and tags
+    interned), the text given to the LLM is rendered only for the rows that are returned by a search
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.kinds = array('b')
+        self.file_names = array('i')
+        self.positions = array('i')
+        self.date_offsets, self.date_values = array('q', [0]), array('i')
+        self.tag_offsets, self.tag_values = array('q', [0]), array('i')
+        self.above, self.below, self.title, self.content = StringColumn(), StringColumn(), StringColumn(), \
+            StringColumn()
+        self.names, self.dates, self.tags = Vocabulary(), Vocabulary(), Vocabulary()
+        self._sorted = None  # (sorted ids, rows), rebuilt after changes
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, object_id, document):
+        """
+        Add one row
+        Args:
+            object_id: id of the row
+            document: Object, or plain text
+        """
+        self._sorted = None
+        self.ids.append(object_id)
+        if isinstance(document, str):
+            self.kinds.append(raw_kind)
+            self._append_fields("", 0, "", "", "", document, (), ())
+            return
+
+        content = document.content
+        self.kinds.append(table_kind if type(content) is dict else text_kind)
+        self._append_fields(document.file_name, document.position, document.above or "", document.below or "",
+                            document.title or "", str(content) if type(content) is dict else content,
+                            document.date, document.tags)
+
+    def _append_fields(self, file_name, position, above, below, title, content, dates, tags):
+        self.file_names.append(self.names.intern(file_name))
+        self.positions.append(position)
+        self.above.append(above)
+        self.below.append(below)
+        self.title.append(title)
+        self.content.append(content)
+        self.date_values.extend(self.dates.intern(date) for date in dates)
+        self.date_offsets.append(len(self.date_values))
+        self.tag_values.extend(self.tags.intern(tag) for tag in tags)
+        self.tag_offsets.append(len(self.tag_values))
+
+    def extend(self, ids, documents):
+        for object_id, document in zip(ids, documents):
+            self.append(object_id, document)
+
+    def _row_fields(self, row):
+        dates = [self.dates.values[i] for i in self.date_values[self.date_offsets[row]:self.date_offsets[row + 1]]]
+        tags = [self.tags.values[i] for i in self.tag_values[self.tag_offsets[row]:self.tag_offsets[row + 1]]]
+        return (self.names.values[self.file_names[row]], self.positions[row], self.above[row], self.below[row],
+                self.title[row], self.content[row], dates, tags)
+
+    def id_array(self):
+        """Copy of the id column as int64 numpy array (a view would lock the array against appends)"""
+        return np.frombuffer(self.ids, dtype=np.int64).copy() if len(self.ids) else np.empty(0, dtype=np.int64)
+
+    def row(self, object_id):
+        """Row number of an object id, -1 if missing"""
+        if self._sorted is None:
+            ids = self.id_array()
+            rows = np.argsort(ids, kind="stable")
+            self._sorted = (ids[rows], rows)
+        sorted_ids, rows = self._sorted
+        i = np.searchsorted(sorted_ids, object_id)
+        if i < len(sorted_ids) and sorted_ids[i] == object_id:
+            return int(rows[i])
+        return -1
+
+    def __contains__(self, object_id):
+        return self.row(object_id) >= 0
+
+    def render_row(self, row):
+        """Text of a row, same as Object.to_str() for objects"""
+        if self.kinds[row] == raw_kind:
+            return self.content[row]
+        file_name, _, above, below, title, content, dates, _ = self._row_fields(row)
+        res = "Filename: " + file_name + '\n'
+        res += "Preceding: " + above + '\n'
+        res += "Succeeding: " + below + '\n'
+        res += "Date: " + ','.join(dates) + '\n'
+        if self.kinds[row] == table_kind:
+            res += "Table Name: " + title + '\n'
+            res += "Table Content:\n" + content + '\n'
+        else:
+            res += "Content:\n" + content + '\n'
+        return res
+
+    def render(self, object_id):
+        row = self.row(object_id)
+        if row < 0:
+            raise KeyError(object_id)
+        return self.render_row(row)
+
+    def texts(self):
+        """(object id, text) of all rows, rendered one at a time"""
+        for row in range(len(self.ids)):
+            yield self.ids[row], self.render_row(row)
+
+    def max_id(self):
+        return max(self.ids) if len(self.ids) else -1
+
+    def take(self, rows, offset=0, table=None):
+        """
+        Copy rows into a table
+        Args:
+            rows: row numbers to copy
+            offset: added to the copied ids
+            table: table to append to, a new one by default
+        """
+        table = ObjectTable() if table is None else table
+        for row in rows:
+            table._sorted = None
+            table.ids.append(self.ids[row] + offset)
+            table.kinds.append(self.kinds[row])
+            table._append_fields(*self._row_fields(row))
+        return table
+
+    def merge(self, other, offset=0):
+        """Append the rows of another table, its ids shifted by offset"""
+        other.take(range(len(other)), offset, self)
+
+    def remove_files(self, file_ids):
+        """Remove the rows of some files"""
+        keep = ~np.isin(self.id_array() >> object_id_bits, list(file_ids))
+        if keep.all():
+            return
+        table = self.take(np.flatnonzero(keep).tolist())
+        self.__dict__.update(table.__dict__)
+
+    def nbytes(self):
+        """Approximate memory of the table"""
+        arrays = (self.ids, self.kinds, self.file_names, self.positions, self.date_offsets, self.date_values,
+                  self.tag_offsets, self.tag_values)
+        size = sum(a.itemsize * len(a) for a in arrays)
+        size += sum(column.nbytes() for column in (self.above, self.below, self.title, self.content))
+        size += self.names.nbytes() + self.dates.nbytes() + self.tags.nbytes()
+        if self._sorted is not None:
+            size += self._sorted[0].nbytes + self._sorted[1].nbytes
+        return size
+
+    def save(self, embedded_file_path):
+        arrays = {"ids": self.ids, "kinds": self.kinds, "file_names": self.file_names, "positions": self.positions,
+                  "date_offsets": self.date_offsets, "date_values": self.date_values,
+                  "tag_offsets": self.tag_offsets, "tag_values": self.tag_values}
+        arrays = {name: np.array(values, dtype=values.typecode) for name, values in arrays.items()}
+        for name in ("above", "below", "title", "content"):
+            column = getattr(self, name)
+            arrays[name + "_data"] = np.frombuffer(bytes(column.data), dtype=np.uint8)
+            arrays[name + "_offsets"] = np.array(column.offsets, dtype=np.int64)
+        for name in ("names", "dates", "tags"):
+            arrays[name] = np.array(getattr(self, name).values, dtype=str)
+        np.savez(os.path.join(embedded_file_path, object_table_file_name), **arrays)
+
+    @classmethod
+    def load(cls, embedded_file_path):
+        table = cls()
+        with np.load(os.path.join(embedded_file_path, object_table_file_name)) as data:
+            for name in ("ids", "kinds", "file_names", "positions", "date_offsets", "date_values", "tag_offsets",
+                         "tag_values"):
+                setattr(table, name, array(getattr(table, name).typecode, data[name].tobytes()))
+            for name in ("above", "below", "title", "content"):
+                setattr(table, name, StringColumn(data[name + "_data"].tobytes(), data[name + "_offsets"].tolist()))
+            for name in ("names", "dates", "tags"):
+                setattr(table, name, Vocabulary(data[name].tolist()))
+        return table
+
+    @classmethod
+    def from_texts(cls, texts: dict):
+        """Table of plain documents, e.g. a doc_map.json saved before the object table"""
+        table = cls()
+        table.extend(texts.keys(), texts.values())
+        return table
+
+
+def has_object_table(embedded_file_path):
+    return os.path.exists(os.path.join(embedded_file_path, object_table_file_name))
+
+
+if __name__ == "__main__":
+    # Memory per object: rendered to_str() strings in a dict (doc_map) vs the object table,
+    # and Object instances with __dict__ vs __slots__
+    import tracemalloc
+
+    objects = read_objects_file("D:\\CS\\CS510\\final-project\\data\\outputdata\\Store")
+
+    tracemalloc.start()
+    doc_map = {obj.object_id: obj.to_str() for obj in objects}
+    doc_map_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    table = ObjectTable()
+    table.extend([obj.object_id for obj in objects], objects)
+    table.row(0)  # lookup arrays
+    table_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    assert all(table.render(object_id) == text for object_id, text in doc_map.items())
+    print(f"{len(objects)} objects: doc_map {doc_map_bytes / len(objects):.0f} B/object, "
+          f"object table {table_bytes / len(objects):.0f} B/object (nbytes {table.nbytes() / len(objects):.0f})")
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+
+import numpy as np
+import faiss  # faiss-cpu
+from tabulate import tabulate
+
+from src.storages.vector_store import VectorStore
+from src.storages.faiss_search import resolve_index_spec
+
+recall_report_file_name = "recall_report.json"
+
+default_specs = ("flat", "fp16", "sq8", "pq", "pca_flat", "pca_sq8", "ivf_flat", "ivf_sq8", "ivf_pq", "hnsw",
+                 "hnsw_sq8")
+
+
+def recall_at_k(exact, approx, k):
+    """Mean fraction of the exact k nearest ids found by the approximate search"""
+    return float(np.mean([len(set(e[:k]) & set(a[:k])) / k for e, a in zip(exact, approx)]))
+
+
+def search_neighbors(index, queries, k, self_rows=None):
+    """
+    k nearest rows of each query
+    Args:
+        index: faiss index over the knowledge base vectors, row number as id
+        queries: (nq, dim) float32
+        k: neighbors
+        self_rows: row of each query if the queries are stored vectors, that row is not counted as a neighbor
+
+    Returns:
+        (nq, k) row numbers, -1 padded
+    """
+    if self_rows is None:
+        return index.search(queries, k)[1]
+    found = index.search(queries, k + 1)[1]
+    return np.array([[row for row in rows if row != self_row][:k] for rows, self_row in zip(found, self_rows)])
+
+
+def recall_report(embedded_file_path, specs=default_specs, k=10, n_queries=200, queries=None, field="search_index",
+                  nprobe=None, ef_search=None, train_size=100000, seed=0):
+    """
+    Memory and recall@k of vector compression settings against exact search on one knowledge base
+    Args:
+        embedded_file_path: embeddata folder of the knowledge base
+        specs: FaissIdx index specs to compare, presets or faiss factory strings
+        k: neighbors compared
+        n_queries: stored vectors sampled as queries when queries is not given, their own row is excluded
+        queries: (nq, dim) query embeddings, e.g. FaissIdx.embed_queries of real questions
+        field: vector store field that is indexed
+        nprobe: IVF lists visited, as FaissIdx
+        ef_search: HNSW search queue size, as FaissIdx
+        train_size: max vectors sampled to train IVF/PQ/PCA
+        seed: sampling seed
+
+    Returns:
+        list of {"setting", "factory", "bytes_per_vector", "fixed_kb", "compression", "recall", "build_s",
+        "search_ms"}, also printed and saved to recall_report.json. bytes_per_vector is the index size per added
+        vector, fixed_kb the trained part (centroids, codebooks, PCA matrix), compression is against float32 Flat
+    """
+    store = VectorStore(embedded_file_path, "objects")
+    stored = store.load(field)
+    vectors = np.ascontiguousarray(stored, dtype=np.float32)
+    n, dim = vectors.shape
+    rng = np.random.default_rng(seed)
+    if queries is None:
+        self_rows = np.sort(rng.choice(n, min(n_queries, n), replace=False))
+        queries = vectors[self_rows]
+    else:
+        self_rows = None
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+    k = min(k, n - (self_rows is not None))
+
+    exact_index = faiss.IndexFlatL2(dim)
+    exact_index.add(vectors)
+    exact = search_neighbors(exact_index, queries, k, self_rows)
+    flat_bytes = 4 * dim
+
+    rows = []
+
+    def add_row(setting, factory, bytes_per_vector, fixed_bytes, approx, build_s, search_s):
+        rows.append({"setting": setting, "factory": factory, "bytes_per_vector": round(bytes_per_vector, 1),
+                     "fixed_kb": round(fixed_bytes / 1024, 1),
+                     "compression": round(flat_bytes / bytes_per_vector, 1),
+                     "recall": round(recall_at_k(exact, approx, k), 4),
+                     "build_s": round(build_s, 3), "search_ms": round(1000 * search_s / len(queries), 3)})
+
+    # Exact search over vectors rounded to the float16 vector store
+    start = time.perf_counter()
+    half_index = faiss.IndexFlatL2(dim)
+    half_index.add(vectors.astype(np.float16).astype(np.float32))
+    built = time.perf_counter()
+    approx = search_neighbors(half_index, queries, k, self_rows)
+    add_row("float16 store", "Flat", 2 * dim, 0, approx, built - start, time.perf_counter() - built)
+
+    for spec in specs:
+        factory = resolve_index_spec(spec, n, dim)
+        start = time.perf_counter()
+        index = faiss.index_factory(dim, factory)
+        try:
+            if not index.is_trained:
+                sample = np.sort(rng.choice(n, min(n, train_size), replace=False))
+                index.train(vectors[sample])
+        except RuntimeError as e:
+            print(f"Cannot train {factory} on {n} vectors: {e}")
+            continue
+        fixed_bytes = len(faiss.serialize_index(index))  # centroids, codebooks, PCA matrix
+        index.add(vectors)
+        params = faiss.ParameterSpace()
+        for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+            if value is not None:
+                try:
+                    params.set_index_parameter(index, name, value)
+                except RuntimeError:
+                    pass
+        built = time.perf_counter()
+        approx = search_neighbors(index, queries, k, self_rows)
+        searched = time.perf_counter()
+        bytes_per_vector = (len(faiss.serialize_index(index)) - fixed_bytes) / n
+        add_row(spec, factory, bytes_per_vector, fixed_bytes, approx, built - start, searched - built)
+
+    print(f"recall@{k} of {len(queries)} queries over {n} vectors ({dim}-d, {stored.dtype} store) "
+          f"in {embedded_file_path}")
+    print(tabulate(rows, headers="keys", tablefmt="psql"))
+    with open(os.path.join(embedded_file_path, recall_report_file_name), 'w', encoding='utf-8') as file:
+        json.dump({"k": k, "queries": len(queries), "vectors": n, "dim": dim, "rows": rows}, file, indent=2)
+    file.close()
+    return rows
+
+
+if __name__ == "__main__":
+    recall_report("D:\\CS\\CS510\\final-project\\data\\embeddata\\Store")
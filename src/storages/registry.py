@@ -0,0 +1,143 @@
+import os
+import threading
+from collections import OrderedDict
+
+from src.storages.faiss_search import FaissIdx, index_file_name
+from src.utils.hash import load_folder_hash
+from src.utils.log import get_console_logger
+
+logger = get_console_logger('Registry')
+
+
+def resident_size(faiss_idx: FaissIdx, embedded_file_path):
+    """
+    Approximate memory held by a loaded knowledge base
+    Args:
+        faiss_idx: FaissIdx of the knowledge base
+        embedded_file_path: its embeddata folder
+
+    Returns:
+        bytes: serialized index size (the index is about that large in memory, or in page cache when
+        memory-mapped) + object table + tag/BM25 index arrays
+    """
+    size = os.path.getsize(os.path.join(embedded_file_path, index_file_name))
+    size += faiss_idx.objects.nbytes()
+    if faiss_idx.tag_index is not None:
+        size += faiss_idx.tag_index.offsets.nbytes + faiss_idx.tag_index.ids.nbytes
+    if faiss_idx.lexical_index is not None:
+        lexical = faiss_idx.lexical_index
+        size += sum(array.nbytes for array in (lexical.offsets, lexical.posting_rows, lexical.posting_tfs,
+                                               lexical.doc_ids, lexical.doc_lens, lexical.idf, lexical.norms))
+    return size
+
+
+class IndexRegistry:
+    """
+    One FaissIdx per knowledge base, least recently used knowledge bases are unloaded when the resident size
+    of all of them exceeds the memory budget, and reloaded from embeddata when they are used again
+    """
+
+    def __init__(self, model, memory_budget_mb=2048, mmap=True, **index_kwargs):
+        """
+        Args:
+            model: embedding model shared by all knowledge bases
+            memory_budget_mb: resident size above which least recently used knowledge bases are unloaded
+            mmap: load indexes memory-mapped (faiss.IO_FLAG_MMAP)
+            index_kwargs: FaissIdx arguments (index_spec, nprobe, ef_search, search_mode...)
+        """
+        self.model = model
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.mmap = mmap
+        self.index_kwargs = index_kwargs
+        self.paths = {}  # knowledge base -> embeddata folder, also for unloaded ones
+        self.versions = {}  # knowledge base -> hash.txt of its last ingestion
+        self.resident = OrderedDict()  # knowledge base -> (FaissIdx, size), least recently used first
+        self.loads = 0
+        self.evictions = 0
+        self._lock = threading.RLock()  # held only to read or publish the tables above, never during a load
+        self._loading = {}  # knowledge base -> Lock held while it is reloaded from disk
+
+    def load(self, name, embedded_file_path):
+        """
+        (Re)load a knowledge base from its embeddata folder, replacing the resident copy
+        Args:
+            name: knowledge base name
+            embedded_file_path: embeddata folder with a saved index
+
+        Returns:
+            FaissIdx of the knowledge base
+        """
+        faiss_idx = FaissIdx(self.model, **self.index_kwargs)
+        faiss_idx.load_folder(embedded_file_path, mmap=self.mmap)
+        size = resident_size(faiss_idx, embedded_file_path)
+        with self._lock:
+            self.paths[name] = embedded_file_path
+            self.versions[name] = load_folder_hash(embedded_file_path)
+            self.resident[name] = (faiss_idx, size)
+            self.resident.move_to_end(name)
+            self.loads += 1
+            self._evict(keep=name)
+        logger.info(f"Loaded {name} ({size / 1024 / 1024:.1f} MB), resident: {self.summary()}")
+        return faiss_idx
+
+    def get(self, name):
+        """
+        FaissIdx of a knowledge base, reloaded from disk if it was unloaded.
+        The reload only blocks callers of the same knowledge base, which then get the reloaded copy
+        Raises:
+            KeyError: the knowledge base was never loaded
+        """
+        with self._lock:
+            if name in self.resident:
+                self.resident.move_to_end(name)
+                return self.resident[name][0]
+            loading = self._loading.setdefault(name, threading.Lock())
+        with loading:
+            with self._lock:
+                if name in self.resident:  # reloaded by another caller while waiting
+                    self.resident.move_to_end(name)
+                    return self.resident[name][0]
+                path = self.paths[name]
+            logger.info(f"Reloading {name}")
+            return self.load(name, path)
+
+    def version(self, name):
+        """
+        Folder hash of the loaded copy of a knowledge base, None if it was never loaded or has no hash.txt.
+        Lock free (one dict lookup), never waits for a reload
+        """
+        return self.versions.get(name)
+
+    def __contains__(self, name):
+        return name in self.paths
+
+    def unload(self, name):
+        with self._lock:
+            self.resident.pop(name, None)
+
+    def _evict(self, keep=None):
+        total = sum(size for _, size in self.resident.values())
+        for name in list(self.resident):
+            if total <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            total -= self.resident.pop(name)[1]
+            self.evictions += 1
+            logger.info(f"Unloaded {name} to stay under {self.memory_budget / 1024 / 1024:.0f} MB")
+
+    def sizes(self):
+        """{knowledge base: resident bytes}, least recently used first"""
+        with self._lock:
+            return {name: size for name, (_, size) in self.resident.items()}
+
+    def summary(self):
+        sizes = self.sizes()
+        if not sizes:
+            return "none"
+        return ", ".join(f"{name} {size / 1024 / 1024:.1f} MB" for name, size in sizes.items()) + \
+            f" (total {sum(sizes.values()) / 1024 / 1024:.1f} / {self.memory_budget / 1024 / 1024:.0f} MB)"
+
+    def stats(self):
+        return {"resident": self.sizes(), "known": sorted(self.paths), "loads": self.loads,
+                "evictions": self.evictions, "budget_bytes": self.memory_budget}
@@ -0,0 +1,133 @@
+import os
+import re
+
+import numpy as np
+
+from src.loaders.tags import Tags, read_tags_file
+from src.loaders.matcher import TagMatcher
+from src.loaders.dates import month_year_pattern, month_numbers, months
+
+tag_index_file_name = "tag_index.npz"
+
+
+class TagIndex:
+    """
+    Inverted index from tag names and "Month YYYY" dates to object ids.
+    Posting lists are sorted int64 arrays stored back to back in `ids`, term i owns ids[offsets[i]:offsets[i + 1]]
+    """
+
+    def __init__(self, terms=(), offsets=None, ids=None):
+        self.terms = list(terms)
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else np.asarray(offsets, dtype=np.int64)
+        self.ids = np.empty(0, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        self.term_ids = {term: i for i, term in enumerate(self.terms)}
+        self.lower_terms = {}  # lowercase term -> term ids, queries are matched case-insensitively
+        for i, term in enumerate(self.terms):
+            self.lower_terms.setdefault(term.lower(), []).append(i)
+        self.matcher = TagMatcher(self.lower_terms)
+
+    def __len__(self):
+        return len(self.terms)
+
+    @classmethod
+    def from_postings(cls, postings: dict):
+        """
+        Args:
+            postings: {term: iterable of object ids}, terms without ids are skipped
+        """
+        terms, offsets, ids = [], [0], []
+        for term, object_ids in postings.items():
+            object_ids = np.unique(np.fromiter(object_ids, dtype=np.int64))
+            if len(object_ids) == 0:
+                continue
+            terms.append(term)
+            ids.append(object_ids)
+            offsets.append(offsets[-1] + len(object_ids))
+        return cls(terms, offsets, np.concatenate(ids) if ids else None)
+
+    @classmethod
+    def from_tags(cls, tags: Tags):
+        """Index of Tags, date tags are ordinary tags named "Month YYYY" """
+        return cls.from_postings(tags.tags_dict)
+
+    def postings(self, term):
+        """Sorted object ids of a term, empty if the term is unknown"""
+        i = self.term_ids.get(term)
+        if i is None:
+            return self.ids[:0]
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def match(self, query):
+        """
+        Known tags and dates mentioned in a query, as whole words, case-insensitive
+        Args:
+            query: query string
+
+        Returns:
+            (tag list, date list)
+        """
+        lower = query.lower()
+        tags, dates = set(), set()
+        for term in self.matcher.find(lower):
+            if not re.search(r"(?<!\w)" + re.escape(term) + r"(?!\w)", lower):
+                continue
+            for i in self.lower_terms[term]:
+                if month_year_pattern.fullmatch(self.terms[i]):
+                    dates.add(self.terms[i])
+                else:
+                    tags.add(self.terms[i])
+
+        for month, year in month_year_pattern.findall(query):  # "Mar 2025" -> "March 2025"
+            date = f"{months[month_numbers[month.lower()] - 1].capitalize()} {year}"
+            if date in self.term_ids:
+                dates.add(date)
+        return sorted(tags), sorted(dates)
+
+    def candidates(self, query):
+        """
+        Object ids a query can be restricted to: objects with any of its dates and any of its tags
+        Args:
+            query: query string
+
+        Returns:
+            (sorted object ids, matched terms), ids is None if the query mentions no known tag or date
+            or no object has both
+        """
+        tags, dates = self.match(query)
+        groups = [group for group in (tags, dates) if group]
+        if not groups:
+            return None, []
+
+        ids = None
+        for group in groups:
+            group_ids = np.unique(np.concatenate([self.postings(term) for term in group]))
+            ids = group_ids if ids is None else np.intersect1d(ids, group_ids, assume_unique=True)
+        if len(ids) == 0:
+            return None, tags + dates
+        return ids, tags + dates
+
+    def merge(self, other, offset=0):
+        """Add the postings of another TagIndex, its ids shifted by offset"""
+        postings = {term: [self.postings(term)] for term in self.terms}
+        for term in other.terms:
+            postings.setdefault(term, []).append(other.postings(term) + offset)
+        merged = TagIndex.from_postings({term: np.concatenate(lists) for term, lists in postings.items()})
+        self.__init__(merged.terms, merged.offsets, merged.ids)
+
+    def save(self, embedded_file_path):
+        np.savez(os.path.join(embedded_file_path, tag_index_file_name),
+                 terms=np.array(self.terms, dtype=str), offsets=self.offsets, ids=self.ids)
+
+    @classmethod
+    def load(cls, embedded_file_path):
+        with np.load(os.path.join(embedded_file_path, tag_index_file_name)) as data:
+            return cls(data["terms"].tolist(), data["offsets"], data["ids"])
+
+
+def has_tag_index(embedded_file_path):
+    return os.path.exists(os.path.join(embedded_file_path, tag_index_file_name))
+
+
+def build_tag_index(original_file_path):
+    """TagIndex of a knowledge base from the tags file in its outputdata folder"""
+    return TagIndex.from_tags(read_tags_file(original_file_path))
@@ -0,0 +1,161 @@
+import os
+import glob
+
+import numpy as np
+
+ids_field = "ids"
+
+
+class VectorStore:
+    """
+    Binary vector store for one embeddata table (documents/objects/tags).
+    Every field is a contiguous float32 (or float16, half the size) matrix saved as '<name>.<field>.npy',
+    rows are aligned with the int64 id column '<name>.ids.npy'
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+
+    def field_path(self, field):
+        return os.path.join(self.path, f"{self.name}.{field}.npy")
+
+    def exists(self):
+        return os.path.exists(self.field_path(ids_field))
+
+    def fields(self):
+        """Names of the stored vector fields"""
+        prefix = self.name + "."
+        fields = []
+        for path in glob.glob(os.path.join(self.path, prefix + "*.npy")):
+            field = os.path.basename(path)[len(prefix):-len(".npy")]
+            if field != ids_field:
+                fields.append(field)
+        return sorted(fields)
+
+    def dtype(self):
+        """Storage dtype of the vector fields, float32 if there are none"""
+        for field in self.fields():
+            return self.load(field).dtype
+        return np.dtype(np.float32)
+
+    def write(self, ids, fields: dict, dtype=np.float32):
+        """
+        Write id column and vector fields, replacing the existing store
+        Args:
+            ids: object/file/tag ids, one per row
+            fields: {field name: list of vectors or 2-d array}, same row order as ids
+            dtype: storage dtype of the vectors, float32 or float16
+        """
+        os.makedirs(self.path, exist_ok=True)
+        for field in self.fields():
+            if field not in fields:  # stale rows from a previous write
+                os.remove(self.field_path(field))
+
+        ids = np.asarray(ids, dtype=np.int64)
+        np.save(self.field_path(ids_field), ids)
+
+        for field, vectors in fields.items():
+            matrix = to_matrix(vectors)
+            if matrix.shape[0] != ids.shape[0]:
+                raise ValueError(f"Field {field} has {matrix.shape[0]} rows, expected {ids.shape[0]}")
+            np.save(self.field_path(field), matrix.astype(dtype, copy=False))
+
+    def add_field(self, field, vectors):
+        """Add or replace one vector field, rows in the order of the stored ids, in the dtype of the other fields"""
+        matrix = to_matrix(vectors)
+        if matrix.shape[0] != self.ids().shape[0]:
+            raise ValueError(f"Field {field} has {matrix.shape[0]} rows, expected {self.ids().shape[0]}")
+        np.save(self.field_path(field), matrix.astype(self.dtype(), copy=False))
+
+    def ids(self, mmap_mode='r'):
+        return np.load(self.field_path(ids_field), mmap_mode=mmap_mode)
+
+    def load(self, field, mmap_mode='r'):
+        """
+        Open a vector field
+        Args:
+            field: field name
+            mmap_mode: passed to np.load, 'r' maps the file read-only without reading it into memory
+
+        Returns:
+            (n, dim) float32 or float16 matrix, FaissIdx converts chunks to float32 when adding them
+        """
+        return np.load(self.field_path(field), mmap_mode=mmap_mode)
+
+
+class VectorStoreWriter:
+    """
+    Write a VectorStore batch by batch without holding all rows in memory.
+    Rows are appended to raw '<field>.npy.part' files and copied into the .npy files by close()
+    """
+
+    def __init__(self, store: VectorStore, copy_rows=65536, dtype=np.float32):
+        self.store = store
+        self.copy_rows = copy_rows
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.dims = None  # {field: dim}, fixed by the first batch
+        os.makedirs(store.path, exist_ok=True)
+        self._parts = {}
+
+    def part_path(self, field):
+        return self.store.field_path(field) + ".part"
+
+    def append(self, ids, fields: dict):
+        """
+        Append rows
+        Args:
+            ids: ids of the rows
+            fields: {field name: list of vectors or 2-d array}, same fields in every batch
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if ids.shape[0] == 0:
+            return
+        matrices = {field: to_matrix(vectors) for field, vectors in fields.items()}
+        for field, matrix in matrices.items():
+            if matrix.shape[0] != ids.shape[0]:
+                raise ValueError(f"Field {field} has {matrix.shape[0]} rows, expected {ids.shape[0]}")
+
+        if self.dims is None:
+            self.dims = {field: matrix.shape[1] for field, matrix in matrices.items()}
+            for field in [ids_field] + list(matrices):
+                self._parts[field] = open(self.part_path(field), 'wb')
+        elif {field: matrix.shape[1] for field, matrix in matrices.items()} != self.dims:
+            raise ValueError(f"Batch fields {sorted(matrices)} do not match {sorted(self.dims)}")
+
+        self._parts[ids_field].write(ids.tobytes())
+        for field, matrix in matrices.items():
+            self._parts[field].write(matrix.astype(self.dtype, copy=False).tobytes())
+        self.rows += ids.shape[0]
+
+    def close(self):
+        """Turn the part files into the store's .npy files, replacing the existing store"""
+        for part in self._parts.values():
+            part.close()
+        dims = self.dims or {}
+        for field in self.store.fields():
+            if field not in dims:  # stale rows from a previous write
+                os.remove(self.store.field_path(field))
+
+        if self.rows == 0:
+            np.save(self.store.field_path(ids_field), np.empty(0, dtype=np.int64))
+            return
+
+        shapes = {ids_field: ((self.rows,), np.int64)}
+        shapes.update({field: ((self.rows, dim), self.dtype) for field, dim in dims.items()})
+        for field, (shape, dtype) in shapes.items():
+            source = np.memmap(self.part_path(field), dtype=dtype, mode='r', shape=shape)
+            target = np.lib.format.open_memmap(self.store.field_path(field), mode='w+', dtype=dtype, shape=shape)
+            for start in range(0, self.rows, self.copy_rows):
+                target[start:start + self.copy_rows] = source[start:start + self.copy_rows]
+            target.flush()
+            del source, target  # release the mappings before removing the part file (Windows)
+            os.remove(self.part_path(field))
+
+
+def to_matrix(vectors) -> np.ndarray:
+    """Stack vectors into a contiguous float32 matrix"""
+    if len(vectors) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.ascontiguousarray(np.stack([np.asarray(v, dtype=np.float32) for v in vectors]))
@@ -1,17 +1,21 @@
 import os
+import json
 import hashlib
 import time
 
+manifest_file_name = "manifest.json"
+hash_file_name = "hash.txt"
+
 
 def _get_folder_info(directory):
     file_info = []
-    for filename in os.listdir(directory):
-        filepath = os.path.join(directory, filename)
-        if os.path.isfile(filepath):
+    for root, _, filenames in os.walk(directory):  # loop subfolders
+        for filename in filenames:
+            filepath = os.path.join(root, filename)
             # last modified time
             modified_time = os.path.getmtime(filepath)
             modified_time_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(modified_time))
-            file_info.append((filename, modified_time_str))
+            file_info.append((os.path.relpath(filepath, directory), modified_time_str))
     return file_info
 
 
@@ -22,7 +26,7 @@ def get_folder_hash(directory):
         directory: folder path
 
     Returns:
-        {filename}_{last_modified_time} hash
+        {relative path}_{last_modified_time} hash, subfolders included
     """
     file_info = _get_folder_info(directory)
     file_info_sorted = sorted(file_info)
@@ -35,6 +39,109 @@ def get_folder_hash(directory):
     return hex_dig
 
 
+def save_folder_hash(embed_path, hash_value):
+    """Knowledge base version, get_folder_hash of its input folder when it was last ingested"""
+    with open(os.path.join(embed_path, hash_file_name), 'w') as file:
+        file.write(hash_value)
+    file.close()
+
+
+def load_folder_hash(embed_path):
+    """Hash saved by save_folder_hash, None if the knowledge base has none"""
+    path = os.path.join(embed_path, hash_file_name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        hash_value = file.read().strip()
+    file.close()
+    return hash_value
+
+
+def get_file_hash(filepath):
+    """sha256 of file content"""
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha.update(block)
+    file.close()
+    return sha.hexdigest()
+
+
+def build_manifest(directory, previous=None, extensions=('.doc', '.docx')):
+    """
+    Per-file manifest of a knowledge base folder, subfolders included
+    Args:
+        directory: knowledge base folder
+        previous: manifest of the last ingestion, content hashes of files with unchanged size and mtime
+                  are reused, file ids are kept stable
+        extensions: file types that are ingested
+
+    Returns:
+        {"next_file_id": int, "files": {relative path: {"file_id", "size", "mtime", "sha256"}}}
+    """
+    previous_files = previous["files"] if previous else {}
+    next_file_id = previous["next_file_id"] if previous else 0
+
+    files = {}
+    for root, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() not in extensions:
+                continue
+            filepath = os.path.join(root, filename)
+            relpath = os.path.relpath(filepath, directory)
+            stat = os.stat(filepath)
+            old = previous_files.get(relpath)
+
+            if old and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime:
+                sha256 = old["sha256"]
+            else:
+                sha256 = get_file_hash(filepath)
+
+            if old:
+                file_id = old["file_id"]
+            else:
+                file_id = next_file_id
+                next_file_id += 1
+            files[relpath] = {"file_id": file_id, "size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256}
+
+    return {"next_file_id": next_file_id, "files": files}
+
+
+def diff_manifest(old, new):
+    """
+    Compare two manifests
+    Args:
+        old: manifest of the last ingestion, None if there was none
+        new: current manifest
+
+    Returns:
+        (added, changed, removed) relative path lists, files whose content hash is unchanged are not listed
+    """
+    old_files = old["files"] if old else {}
+    new_files = new["files"]
+
+    added = [path for path in new_files if path not in old_files]
+    changed = [path for path in new_files if path in old_files and new_files[path]["sha256"] != old_files[path]["sha256"]]
+    removed = [path for path in old_files if path not in new_files]
+    return added, changed, removed
+
+
+def load_manifest(embed_path):
+    manifest_path = os.path.join(embed_path, manifest_file_name)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        manifest = json.load(file)
+    file.close()
+    return manifest
+
+
+def save_manifest(embed_path, manifest):
+    with open(os.path.join(embed_path, manifest_file_name), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+    file.close()
+
+
 if __name__ == "__main__":
     directory = "D:\\CS\\CS510\\final-project\\data\\inputdata\\Test"
 
@@ -0,0 +1,117 @@
+import os
+import time
+import sqlite3
+import threading
+
+
+class SqliteLRU:
+    """
+    On-disk key-value store with a size cap, least recently used entries are evicted first.
+    Entries older than ttl seconds (if given) are treated as missing.
+    Safe to share between threads, and between processes through sqlite's own locking.
+    """
+
+    def __init__(self, path, max_bytes=1 << 30, ttl=None):
+        """
+        Args:
+            path: sqlite file, parent folder is created if missing
+            max_bytes: cap on the total size of stored values
+            ttl: seconds an entry stays valid, None for no expiry
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB, size INTEGER, "
+                           "created REAL, last_access REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS kv_last_access ON kv (last_access)")
+        self._conn.commit()
+
+    def get_many(self, keys):
+        """
+        Look up keys, hits are marked as recently used
+        Args:
+            keys: list of keys
+
+        Returns:
+            {key: value} for the keys that were found
+        """
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), 500):  # sqlite variable limit
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(f"SELECT key, value, created FROM kv WHERE key IN "
+                                          f"({','.join('?' * len(chunk))})", chunk).fetchall()
+                for key, value, created in rows:
+                    if self.ttl is None or now - created <= self.ttl:
+                        found[key] = value
+            self._conn.executemany("UPDATE kv SET last_access = ? WHERE key = ?", [(now, key) for key in found])
+            self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        """
+        Store values, then evict least recently used entries until under max_bytes
+        Args:
+            items: {key: bytes}
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO kv VALUES (?, ?, ?, ?, ?)",
+                                   [(key, value, len(value), now, now) for key, value in items.items()])
+            self._evict()
+            self._conn.commit()
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def _evict(self):
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM kv WHERE created < ?", (time.time() - self.ttl,))
+
+        excess = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM kv").fetchone()[0] - self.max_bytes
+        victims = []
+        cursor = self._conn.execute("SELECT key, size FROM kv ORDER BY last_access")
+        while excess > 0:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                victims.append((key,))
+                excess -= size
+        cursor.close()
+        self._conn.executemany("DELETE FROM kv WHERE key = ?", victims)
+
+    def delete_prefix(self, prefix):
+        """Remove every entry whose key starts with prefix, returns the number removed"""
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM kv WHERE substr(key, 1, ?) = ?",
+                                         (len(prefix), prefix)).rowcount
+            self._conn.commit()
+        return removed
+
+    def stats(self):
+        """Hit/miss counters of this process and current store size"""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM kv").fetchone()
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries, "bytes": size}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()